@@ -0,0 +1,62 @@
+import numpy as np
+
+# Duration samples for the planners, drawn in large vectorized blocks per (task, diagnosis)
+# from a seeded generator instead of one numpy call per duration.
+
+# (mean, standard deviation) in hours, diagnosis None = same for every diagnosis
+healthcare_durations = {
+    ("intake", None): (1, 1 / 8),
+    ("surgery", "A2"): (1, 1 / 4),
+    ("surgery", "A3"): (2, 1 / 2),
+    ("surgery", "A4"): (4, 1 / 2),
+    ("surgery", "B3"): (4, 1 / 2),
+    ("surgery", "B4"): (4, 1),
+    ("nursing", "A1"): (4, 1 / 2),
+    ("nursing", "A2"): (8, 2),
+    ("nursing", "A3"): (16, 2),
+    ("nursing", "A4"): (16, 2),
+    ("nursing", "B1"): (8, 2),
+    ("nursing", "B2"): (16, 2),
+    ("nursing", "B3"): (16, 4),
+    ("nursing", "B4"): (16, 4),
+}
+path_tasks = ["intake", "surgery", "nursing"]
+
+
+class DurationSampler:
+    def __init__(self, distributions=None, seed=None, block_size=1024):
+        self.distributions = (
+            distributions if distributions is not None else healthcare_durations
+        )
+        # without a seed, follow the global numpy seed (e.g. of a replication)
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.pools = {}  # (task, diagnosis) -> pre-drawn samples
+        self.positions = {}  # (task, diagnosis) -> index of the next unused sample
+
+    def get_key(self, task, diagnosis):
+        if (task, diagnosis) in self.distributions:
+            return (task, diagnosis)
+        if (task, None) in self.distributions:
+            return (task, None)
+        return None  # task does not apply to the diagnosis
+
+    def sample(self, task, diagnosis):
+        key = self.get_key(task, diagnosis)
+        if key is None:
+            return 0
+        position = self.positions.get(key, self.block_size)
+        if position >= self.block_size:
+            # refill lazily once the block is used up
+            mean, std = self.distributions[key]
+            self.pools[key] = self.rng.normal(mean, std, self.block_size)
+            position = 0
+        self.positions[key] = position + 1
+        return float(self.pools[key][position])
+
+    # one duration per task of a patient path; evaluating several arrival times with the
+    # same path (common random numbers) compares them under equal conditions
+    def draw_path(self, diagnosis):
+        return {task: self.sample(task, diagnosis) for task in path_tasks}
@@ -3,8 +3,9 @@ from datetime import datetime, timedelta
 
 
 class Logger:
-    def __init__(self, log_file):
+    def __init__(self, log_file, kpis=None):
         self.log_file = log_file
+        self.kpis = kpis  # optional KpiAggregator, fed with every logged event
         self.lock = threading.Lock()
         self.start_time = datetime(2018, 1, 1)  # Baseline for simulation
 
@@ -29,6 +30,10 @@ class Logger:
         self, id, event_type, arrival_time, start_time, end_time, metadata=None
     ):
         with self.lock:
+            if self.kpis is not None:
+                self.kpis.add_event(
+                    id, event_type, arrival_time, start_time, end_time, metadata
+                )
             with open(self.log_file, mode="a", newline="") as file:
                 writer = csv.writer(file)
                 writer.writerow(
@@ -42,6 +47,28 @@ class Logger:
                     ]
                 )
 
+    # several rows (id, event_type, arrival_time, start_time, end_time, metadata) at once
+    def log_events(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            if self.kpis is not None:
+                for row in rows:
+                    self.kpis.add_event(*row)
+            with open(self.log_file, mode="a", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerows(
+                    [
+                        id,
+                        event_type,
+                        self.start_time + timedelta(minutes=arrival_time),
+                        self.start_time + timedelta(minutes=start_time),
+                        self.start_time + timedelta(minutes=end_time),
+                        metadata,
+                    ]
+                    for id, event_type, arrival_time, start_time, end_time, metadata in rows
+                )
+
 
 def sort_log_by_arrival_time(log_file):
     with open(log_file, mode="r", newline="") as file:
@@ -70,4 +97,71 @@ def sort_log_by_arrival_time(log_file):
     print(f"Log-Datei {log_file} wurde erfolgreich nach Arrival_Time sortiert.")
 
 
+def compute_scores(log_file):
+    # er_treatment_score: mean minutes from admission to release of emergency patients
+    # sent_home_score: number of times a patient was sent home instead of being treated
+    # processed_score: mean minutes from (last) admission to release of treated patients
+    with open(log_file, mode="r", newline="") as file:
+        log_data = list(csv.DictReader(file))
+
+    def to_minutes(value):
+        dt = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        return (dt - datetime(2018, 1, 1)).total_seconds() / 60
+
+    patients = {}
+    for row in log_data:
+        patients.setdefault(row["ID"], []).append(row)
+
+    er_times, processed_times = [], []
+    sent_home = 0
+    for rows in patients.values():
+        # every admission starts a new stay (patients that were sent home come back)
+        stays = []
+        for row in rows:
+            if row["Event_Type"] == "Admission":
+                stays.append([])
+            if stays:
+                stays[-1].append(row)
+
+        for stay in stays:
+            event_types = [row["Event_Type"] for row in stay]
+            if "Releasing" not in event_types:
+                continue  # patient still in the hospital at the end of the simulation
+            time_in_hospital = to_minutes(stay[-1]["End_Time"]) - to_minutes(
+                stay[0]["Arrival_Time"]
+            )
+            if stay[0]["Metadata"] == "EM":
+                er_times.append(time_in_hospital)
+            elif "Intake" in event_types:
+                processed_times.append(time_in_hospital)
+            else:
+                sent_home += 1
+
+    return {
+        "er_treatment_score": sum(er_times) / len(er_times) if er_times else 0.0,
+        "sent_home_score": float(sent_home),
+        "processed_score": (
+            sum(processed_times) / len(processed_times) if processed_times else 0.0
+        ),
+    }
+
+
+# mean minutes from arrival to start per event type
+def compute_waiting_times(log_file):
+    with open(log_file, mode="r", newline="") as file:
+        log_data = list(csv.DictReader(file))
+
+    waiting_times = {}
+    for row in log_data:
+        arrival = datetime.strptime(row["Arrival_Time"], "%Y-%m-%d %H:%M:%S")
+        start = datetime.strptime(row["Start_Time"], "%Y-%m-%d %H:%M:%S")
+        waiting_times.setdefault(row["Event_Type"], []).append(
+            (start - arrival).total_seconds() / 60
+        )
+    return {
+        event_type: sum(times) / len(times)
+        for event_type, times in waiting_times.items()
+    }
+
+
 # sort_log_by_arrival_time("log.csv")
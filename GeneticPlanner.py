@@ -1,12 +1,63 @@
-import random
+import random, time
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from DurationSampler import DurationSampler
+from NaivePlanner import NaivePlanner
+from ProblemConfig import compile_config
 
 
 class GeneticPlanner:
-    def __init__(self):
+    def __init__(
+        self,
+        problem=None,
+        population_size=50,
+        generations=20,
+        mutation_rate=0.1,
+        min_population_size=10,
+        patience=3,
+        tolerance=1e-3,
+        min_diversity=0.1,
+        time_budget=None,
+        evaluation_budget=None,
+        warm_start_share=0.2,
+        warm_start_window=24,
+        sampler=None,
+        common_random_numbers=True,
+    ):
         # patients with assigend timeslot
         self.scheduled_patients = []
+        # compiled problem config (capacities and working hours)
+        self.problem = problem if problem is not None else compile_config()
+
+        # genetic algorithm settings (population_size and generations are maximums)
+        self.population_size = population_size
+        self.generations = generations
+        self.mutation_rate = mutation_rate
+        self.min_population_size = min_population_size
+        # stop after patience generations without improving the best penalty by tolerance
+        self.patience = patience
+        self.tolerance = tolerance
+        # stop once the arrival times of the population spread less (std in hours)
+        self.min_diversity = min_diversity
+        # per plan() call: seconds and penalty evaluations, None = unlimited
+        self.time_budget = time_budget
+        self.evaluation_budget = evaluation_budget
+
+        # cost of the last plan() call and of all calls
+        self.last_plan_stats = None
+        self.total_evaluations = 0
+
+        # share of the initial population seeded from the naive plan and recent best
+        # solutions of the same diagnosis planned at most warm_start_window hours ago
+        self.warm_start_share = warm_start_share
+        self.warm_start_window = warm_start_window
+        self.recent_solutions = {}  # diagnosis -> [(current_time, best_arrival_time)]
+        self.naive_planner = NaivePlanner(datetime(2018, 1, 1), self.problem)
+
+        # pre-drawn duration samples; with common random numbers all individuals of all
+        # generations of a plan() call are evaluated with the same durations
+        self.sampler = sampler if sampler is not None else DurationSampler()
+        self.common_random_numbers = common_random_numbers
 
     def plan(self, cid, current_time, info, resources):
         # - cid: Patient ID
@@ -35,32 +86,81 @@ class GeneticPlanner:
                 )
 
         # initial population of arrival times
-        population_size = 50
-        generations = 20
-        mutation_rate = 0.1
-        population = self.generate_initial_population(current_time, population_size)
-
-        # Run genetic algorithm
-        for _ in range(generations):
+        start = time.time()
+        population = self.generate_initial_population(
+            current_time,
+            self.population_size,
+            self.get_warm_start_seeds(current_time, info),
+        )
+        initial_diversity = np.std(population)
+        evaluations = 0
+        best_arrival_time, best_penalty = None, float("inf")
+        stalled_generations = 0
+        stop_reason = "generations"
+        # one draw for the whole call, so penalties of different generations are comparable
+        # (plateau check and best of all generations)
+        durations = None
+        if self.common_random_numbers:
+            durations = self.sampler.draw_path(info["diagnosis"])
+
+        # Run genetic algorithm (the last generation is only evaluated)
+        for generation in range(self.generations + 1):
             # Evaluate fitness
             fitness_scores = []
             for arrival_time in population:
                 penalty = self.compute_penalty(
-                    arrival_time, current_time, info, resources, self.scheduled_patients
+                    arrival_time,
+                    current_time,
+                    info,
+                    resources,
+                    self.scheduled_patients,
+                    durations,
                 )
                 fitness_scores.append(-penalty)  # aim: minimize penalty
+            evaluations += len(population)
 
+            # keep the best arrival time of all generations
+            generation_best = int(np.argmax(fitness_scores))
+            if -fitness_scores[generation_best] < best_penalty - self.tolerance:
+                stalled_generations = 0
+            else:
+                stalled_generations += 1
+            if -fitness_scores[generation_best] < best_penalty:
+                best_arrival_time = population[generation_best]
+                best_penalty = -fitness_scores[generation_best]
+
+            diversity = np.std(population)
+            if generation == self.generations:
+                break
+            if stalled_generations >= self.patience:
+                stop_reason = "plateau"
+                break
+            if diversity < self.min_diversity:
+                stop_reason = "diversity"
+                break
+            if self.budget_exhausted(start, evaluations):
+                stop_reason = "budget"
+                break
+
+            # shrink the population while it converges
+            population_size = self.adapt_population_size(diversity, initial_diversity)
             selected = self.selection(population, fitness_scores)
             offspring = self.crossover(selected, population_size)
-            population = self.mutation(offspring, current_time, mutation_rate)
-
-        # chose the best arrival time from the final population
-        best_arrival_time = min(
-            population,
-            key=lambda at: self.compute_penalty(
-                at, current_time, info, resources, self.scheduled_patients
-            ),
-        )
+            population = self.mutation(offspring, current_time, self.mutation_rate)
+
+        self.last_plan_stats = {
+            "evaluations": evaluations,
+            "generations": generation + 1,
+            "stop_reason": stop_reason,
+            "best_penalty": best_penalty,
+            "duration": time.time() - start,
+        }
+        self.total_evaluations += evaluations
+
+        # remember the solution to warm start the next patients with this diagnosis
+        recent = self.recent_solutions.setdefault(info["diagnosis"], [])
+        recent.append((current_time, best_arrival_time))
+        del recent[: -max(1, int(self.population_size * self.warm_start_share))]
 
         # update scheduled_patients
         patient_schedule = self.simulate_patient_path(
@@ -79,50 +179,87 @@ class GeneticPlanner:
 
         return best_arrival_time
 
-    def generate_initial_population(self, current_time, population_size):
+    def budget_exhausted(self, start, evaluations):
+        if self.evaluation_budget is not None and evaluations >= self.evaluation_budget:
+            return True
+        if self.time_budget is not None and time.time() - start >= self.time_budget:
+            return True
+        return False
+
+    def adapt_population_size(self, diversity, initial_diversity):
+        # Population size proportional to the remaining spread of arrival times.
+        if initial_diversity <= 0:
+            return self.min_population_size
+        population_size = round(self.population_size * diversity / initial_diversity)
+        return int(
+            min(max(population_size, self.min_population_size), self.population_size)
+        )
+
+    def get_warm_start_seeds(self, current_time, info):
+        # Naive plan and recent best solutions, shifted by the time since they were planned.
+        min_time = current_time + 24
+        max_time = current_time + 7 * 24
+        seeds = [self.naive_planner.plan(current_time * 60) / 60]
+        for planned_at, best_arrival_time in reversed(
+            self.recent_solutions.get(info["diagnosis"], [])
+        ):
+            if current_time - planned_at > self.warm_start_window:
+                continue
+            shifted = best_arrival_time + (current_time - planned_at)
+            shifted = self.skip_to_next_working_hour(
+                min(max(shifted, min_time), max_time)
+            )
+            if shifted <= max_time:
+                seeds.append(shifted)
+        return seeds[: max(1, int(self.population_size * self.warm_start_share))]
+
+    def generate_initial_population(self, current_time, population_size, seeds=()):
         # Generate initial population of arrival times within constraints.
-        population = []
-        for _ in range(population_size):
-            arrival_time = self.generate_random_arrival_time(current_time)
+        population = list(seeds)[:population_size]
+        working_intervals = self.get_working_intervals(current_time)
+        for _ in range(population_size - len(population)):
+            arrival_time = self.sample_working_time(working_intervals)
             population.append(arrival_time)
         return population
 
     def generate_random_arrival_time(self, current_time):
         # Generate a random arrival time within allowed constraints.
+        return self.sample_working_time(self.get_working_intervals(current_time))
+
+    def get_working_intervals(self, current_time):
+        # Working hours between min_time and max_time as (start, end) intervals.
         # Time constraints
         min_time = current_time + 24  # At least 24 hours after current time
         max_time = current_time + 7 * 24  # No more than 7 days after current time
 
-        # Generate random time within min_time and max_time during working hours
-        while True:
-            random_time = random.uniform(min_time, max_time)
-            if self.is_working_hour(random_time):
-                return random_time
+        intervals = []
+        hour = int(np.floor(min_time))
+        while hour < max_time:
+            if self.is_working_hour(hour):
+                intervals.append((max(hour, min_time), min(hour + 1, max_time)))
+            hour += 1
+        return intervals
 
-    def is_working_hour(self, time_in_hours):
-        # Check if the given time falls within working hours (Mon-Fri, 8:00-17:00).
-        # Convert hours since time 0 to datetime
-        base_time = datetime(2018, 1, 1)
-        current_datetime = base_time + timedelta(hours=time_in_hours)
+    def sample_working_time(self, working_intervals):
+        # Uniform random time from the working hours (no rejection sampling).
+        lengths = [end - start for start, end in working_intervals]
+        start, end = random.choices(working_intervals, weights=lengths, k=1)[0]
+        return random.uniform(start, end)
 
-        # Check if it's a weekday
-        if current_datetime.weekday() >= 5:
-            return False
-
-        # Check if it's within working hours
-        if 8 <= current_datetime.hour < 17:
-            return True
-        return False
+    def is_working_hour(self, time_in_hours):
+        # Check if the given time falls within working hours (opening hours of the intake).
+        return self.problem.is_working_hour("Intake", time_in_hours * 60)
 
     def simulate_patient_path(
-        self, arrival_time, current_time, info, scheduled_patients
+        self, arrival_time, current_time, info, scheduled_patients, durations=None
     ):
         # Simulate the patient's path and schedule their resource usage.
+        # durations: fixed task durations (common random numbers), sampled if None
         # Initialize patient schedule
         patient_schedule = {"tasks": [], "start_times": [], "durations": []}
 
         # Start with intake
-        intake_duration = np.random.normal(1, 1 / 8)
+        intake_duration = self.get_task_duration("intake", info, durations)
         intake_start_time = self.find_next_available_time(
             "intake", arrival_time, intake_duration, scheduled_patients
         )
@@ -154,7 +291,7 @@ class GeneticPlanner:
 
         # Schedule surgery if needed
         if needs_surgery:
-            surgery_duration = self.get_surgery_duration(diagnosis)
+            surgery_duration = self.get_task_duration("surgery", info, durations)
             earliest_surgery_time = intake_start_time + intake_duration
             surgery_start_time = self.find_next_available_time(
                 "surgery", earliest_surgery_time, surgery_duration, scheduled_patients
@@ -182,7 +319,7 @@ class GeneticPlanner:
 
         # Schedule nursing if needed
         if needs_nursing:
-            nursing_duration = self.get_nursing_duration(diagnosis)
+            nursing_duration = self.get_task_duration("nursing", info, durations)
             # Nursing starts after surgery if surgery is needed
             nursing_start_time = intake_start_time + intake_duration
             if needs_surgery:
@@ -218,14 +355,20 @@ class GeneticPlanner:
         return patient_schedule
 
     def compute_penalty(
-        self, arrival_time, current_time, info, resources, scheduled_patients
+        self,
+        arrival_time,
+        current_time,
+        info,
+        resources,
+        scheduled_patients,
+        durations=None,
     ):
         # Compute the penalty for a given arrival time.
         penalty = 0
 
         # Simulate patient's path
         patient_schedule = self.simulate_patient_path(
-            arrival_time, current_time, info, scheduled_patients.copy()
+            arrival_time, current_time, info, scheduled_patients.copy(), durations
         )
 
         # Penalty if arrival_time exceeds 7 days
@@ -327,21 +470,19 @@ class GeneticPlanner:
         info=None,
     ):
         # Find the next available time slot for a resource.
-        # Get resource capacities
+        # Get the event that holds the resource capacities
         if resource_type == "intake":
-            capacity = 4  # 4 Intakes
+            event_type = "Intake"
             working_hours_only = True
         elif resource_type == "surgery":
-            # 5 surgeries during working hours, 1 outside
-            capacity_day = 5
-            capacity_night = 1
+            event_type = "Surgery"
             working_hours_only = False
         elif resource_type == "nursing":
-            # 30 beds for Type A, 40 beds for Type B
+            # separate wards for Type A and Type B
             if info and info["diagnosis"].startswith("A"):
-                capacity = 30
+                event_type = "Nursing_A"
             else:
-                capacity = 40
+                event_type = "Nursing_B"
             working_hours_only = False
         else:
             return None  # Unknown resource type
@@ -352,10 +493,7 @@ class GeneticPlanner:
 
         while time < max_search_time:
             # Check if resource is available at this time
-            if resource_type == "surgery":
-                capacity = (
-                    capacity_day if self.is_working_hour(time) else capacity_night
-                )
+            capacity = self.problem.get_capacity(event_type, time * 60)
             count = self.count_resource_usage(resource_type, time, scheduled_patients)
             if count < capacity:
                 return time
@@ -382,40 +520,19 @@ class GeneticPlanner:
                         count += 1
         return count
 
-    def get_task_duration(self, task, info):
+    def get_task_duration(self, task, info, durations=None):
         # Get the duration of a task based on diagnosis.
-        if task == "intake":
-            return np.random.normal(1, 1 / 8)
-        elif task == "surgery":
-            return self.get_surgery_duration(info["diagnosis"])
-        elif task == "nursing":
-            return self.get_nursing_duration(info["diagnosis"])
-        return 0
+        if durations is not None:
+            return durations.get(task, 0)
+        return self.sampler.sample(task, info["diagnosis"])
 
     def get_surgery_duration(self, diagnosis):
         # Get surgery duration based on diagnosis.
-        durations = {
-            "A2": np.random.normal(1, 1 / 4),
-            "A3": np.random.normal(2, 1 / 2),
-            "A4": np.random.normal(4, 1 / 2),
-            "B3": np.random.normal(4, 1 / 2),
-            "B4": np.random.normal(4, 1),
-        }
-        return durations.get(diagnosis, 0)
+        return self.sampler.sample("surgery", diagnosis)
 
     def get_nursing_duration(self, diagnosis):
         # Get nursing duration based on diagnosis.
-        durations = {
-            "A1": np.random.normal(4, 1 / 2),
-            "A2": np.random.normal(8, 2),
-            "A3": np.random.normal(16, 2),
-            "A4": np.random.normal(16, 2),
-            "B1": np.random.normal(8, 2),
-            "B2": np.random.normal(16, 2),
-            "B3": np.random.normal(16, 4),
-            "B4": np.random.normal(16, 4),
-        }
-        return durations.get(diagnosis, 0)
+        return self.sampler.sample("nursing", diagnosis)
 
     def skip_to_next_working_hour(self, time_in_hours):
         # Skip to the next working hour.
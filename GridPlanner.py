@@ -0,0 +1,284 @@
+import time
+import numpy as np
+from DurationSampler import healthcare_durations
+from ProblemConfig import HOURS_PER_WEEK, compile_config
+
+# Deterministic alternative to the GeneticPlanner: evaluates every arrival time of a grid
+# over the allowed window at once against an occupancy timeline of the resources, then
+# refines around the best slot with a finer grid. Durations are the expected durations,
+# the penalty is the one of GeneticPlanner.compute_penalty.
+
+needs_surgery = ["A2", "A3", "A4", "B3", "B4"]
+needs_nursing = ["A1", "A2", "A3", "A4", "B1", "B2", "B3", "B4"]
+resource_events = {
+    "intake": "Intake",
+    "surgery": "Surgery",
+    "Nursing_A": "Nursing_A",
+    "Nursing_B": "Nursing_B",
+}
+resource_tasks = {
+    "Intake": "intake",
+    "Surgery": "surgery",
+    "Nursing_A": "nursing",
+    "Nursing_B": "nursing",
+}
+
+
+class GridPlanner:
+    def __init__(
+        self, problem=None, coarse_step=1, fine_step=1 / 12, resolution=1 / 12
+    ):
+        # patients with assigend timeslot
+        self.scheduled_patients = []
+        # compiled problem config (capacities and working hours)
+        self.problem = problem if problem is not None else compile_config()
+        # grid steps and timeline resolution in hours
+        self.coarse_step = coarse_step
+        self.fine_step = fine_step
+        self.resolution = resolution
+        self.last_plan_stats = None
+        self.total_evaluations = 0
+
+    def plan(self, cid, current_time, info, resources):
+        # - cid: Patient ID
+        # - current_time: current simulation time in hours since time 0
+        # - info: patient diagnosis
+        # - resources: info about current hospital resources
+
+        # Returns:
+        # - planned_time: The planned arrival time for the patient
+        start = time.time()
+        timeline = self.prepare(current_time, resources)
+        best_arrival_time, start_indices, penalty, evaluations = self.search(
+            info, timeline
+        )
+        self.commit(cid, info, best_arrival_time, start_indices, timeline)
+
+        self.last_plan_stats = {
+            "evaluations": evaluations,
+            "best_penalty": penalty,
+            "duration": time.time() - start,
+        }
+        self.total_evaluations += evaluations
+        return best_arrival_time
+
+    def plan_batch(self, patients, current_time, resources):
+        # Plan all pending patients of a tick together.
+        # - patients: list of (cid, info)
+        # Returns:
+        # - dict cid -> planned arrival time
+        # Every round evaluates all remaining diagnoses against the common timeline and
+        # places the patient with the highest penalty first (ties by diagnosis and cid),
+        # so the assignment does not depend on the order of the patients. This is a greedy
+        # placement, not a joint optimization: the penalty of a patient only depends on its
+        # own waiting time, and exchanging the placement order found no lower total penalty.
+        start = time.time()
+        timeline = self.prepare(current_time, resources)
+        remaining = list(patients)
+        planned_times = {}
+        evaluations = 0
+        while remaining:
+            results = {}
+            for cid, info in remaining:
+                if info["diagnosis"] not in results:
+                    results[info["diagnosis"]] = self.search(info, timeline)
+                    evaluations += results[info["diagnosis"]][3]
+            index = max(
+                range(len(remaining)),
+                key=lambda i: (
+                    results[remaining[i][1]["diagnosis"]][2],
+                    remaining[i][1]["diagnosis"],
+                    str(remaining[i][0]),
+                ),
+            )
+            cid, info = remaining.pop(index)
+            best_arrival_time, start_indices, _, _ = results[info["diagnosis"]]
+            self.commit(cid, info, best_arrival_time, start_indices, timeline)
+            planned_times[cid] = best_arrival_time
+
+        self.last_plan_stats = {
+            "evaluations": evaluations,
+            "patients": len(patients),
+            "duration": time.time() - start,
+        }
+        self.total_evaluations += evaluations
+        return planned_times
+
+    def prepare(self, current_time, resources):
+        # Occupancy timeline of all resources at current_time.
+        self.scheduled_patients = [
+            p for p in self.scheduled_patients if p["arrival_time"] > current_time
+        ]
+        min_time = current_time + 24  # At least 24 hours after current time
+        max_time = current_time + 7 * 24  # No more than 7 days after current time
+
+        # timeline until the latest arrival plus 7 days of search per task
+        timeline_start = np.floor(min_time / self.resolution) * self.resolution
+        bins = int(np.ceil((max_time + 3 * 7 * 24 - timeline_start) / self.resolution))
+        times = timeline_start + np.arange(bins) * self.resolution
+        occupancy = {
+            resource: self.get_occupancy(resource, times, resources)
+            for resource in resource_events
+        }
+        return {
+            "min_time": min_time,
+            "max_time": max_time,
+            "start": timeline_start,
+            "times": times,
+            "occupancy": occupancy,
+            "next_free": {
+                resource: self.get_next_free(resource, times, occupancy[resource])
+                for resource in resource_events
+            },
+        }
+
+    def search(self, info, timeline):
+        # Best arrival time with its start indices, penalty and number of evaluations.
+        # coarse grid over the whole window, fine grid around the best slot
+        min_time, max_time = timeline["min_time"], timeline["max_time"]
+        candidates = self.get_candidates(min_time, max_time, self.coarse_step)
+        penalties, _ = self.evaluate(
+            candidates, info, timeline["start"], timeline["next_free"]
+        )
+        best = candidates[int(np.argmin(penalties))]
+        fine_candidates = self.get_candidates(
+            max(min_time, best - self.coarse_step),
+            min(max_time, best + self.coarse_step),
+            self.fine_step,
+        )
+        candidates = np.concatenate([candidates, fine_candidates])
+        penalties, start_indices = self.evaluate(
+            candidates, info, timeline["start"], timeline["next_free"]
+        )
+        best_index = int(np.argmin(penalties))
+        return (
+            float(candidates[best_index]),
+            {task: int(indices[best_index]) for task, indices in start_indices.items()},
+            float(penalties[best_index]),
+            len(candidates),
+        )
+
+    def commit(self, cid, info, arrival_time, start_indices, timeline):
+        # Add the planned patient to scheduled_patients and the occupancy timeline.
+        tasks, start_times, durations = [], [], []
+        for task, duration in self.get_path(info):
+            index = start_indices[task]
+            tasks.append(task)
+            start_times.append(
+                None if index < 0 else timeline["start"] + index * self.resolution
+            )
+            durations.append(duration)
+            if index < 0:
+                continue
+            resource = self.get_ward(info) if task == "nursing" else task
+            end = index + int(np.ceil(duration / self.resolution))
+            timeline["occupancy"][resource][index:end] += 1
+            timeline["next_free"][resource] = self.get_next_free(
+                resource, timeline["times"], timeline["occupancy"][resource]
+            )
+        self.scheduled_patients.append(
+            {
+                "cid": cid,
+                "arrival_time": arrival_time,
+                "info": info,
+                "tasks": tasks,
+                "start_times": start_times,
+                "durations": durations,
+            }
+        )
+
+    def get_candidates(self, min_time, max_time, step):
+        # Grid of arrival times within working hours.
+        candidates = np.arange(min_time, max_time + 1e-9, step)
+        return candidates[self.get_capacities("Intake", candidates) > 0]
+
+    def get_capacities(self, event_type, times):
+        # Capacity of the event at all given times (hours) from the compiled config.
+        hours = (
+            np.floor(times).astype(int) + self.problem.start_offset
+        ) % HOURS_PER_WEEK
+        return np.array(self.problem.get_event(event_type).capacities)[hours]
+
+    def get_path(self, info):
+        # Tasks of the patient with their expected durations.
+        diagnosis = info["diagnosis"]
+        path = [("intake", healthcare_durations[("intake", None)][0])]
+        if diagnosis in needs_surgery:
+            path.append(("surgery", healthcare_durations[("surgery", diagnosis)][0]))
+        if diagnosis in needs_nursing:
+            path.append(("nursing", healthcare_durations[("nursing", diagnosis)][0]))
+        return path
+
+    def get_ward(self, info):
+        # separate wards for Type A and Type B
+        if info and info["diagnosis"].startswith("A"):
+            return "Nursing_A"
+        return "Nursing_B"
+
+    def get_occupancy(self, resource, timeline, resources):
+        # Number of scheduled tasks using the resource per timeline bin.
+        starts, ends = [], []
+        for patient in self.scheduled_patients:
+            for task, start_time, duration in zip(
+                patient["tasks"], patient["start_times"], patient["durations"]
+            ):
+                if start_time is None:
+                    continue
+                if task == resource or (
+                    task == "nursing" and self.get_ward(patient["info"]) == resource
+                ):
+                    starts.append(start_time)
+                    ends.append(start_time + duration)
+        # current resources of the simulator (with expected durations)
+        for res in resources:
+            task = resource_tasks.get(res["task"])
+            if task is None or res.get("wait"):
+                continue
+            if task == resource or (task == "nursing" and res["task"] == resource):
+                diagnosis = res["info"]["diagnosis"]
+                key = (task, None) if task == "intake" else (task, diagnosis)
+                duration = healthcare_durations.get(key, (0, 0))[0]
+                starts.append(res["start"])
+                ends.append(res["start"] + duration)
+
+        delta = np.zeros(len(timeline) + 1)
+        first = timeline[0]
+        start_bins = np.clip(
+            np.floor((np.array(starts) - first) / self.resolution), 0, len(timeline)
+        ).astype(int)
+        end_bins = np.clip(
+            np.ceil((np.array(ends) - first) / self.resolution), 0, len(timeline)
+        ).astype(int)
+        np.add.at(delta, start_bins, 1)
+        np.add.at(delta, end_bins, -1)
+        return np.cumsum(delta)[:-1]
+
+    def get_next_free(self, resource, timeline, occupancy):
+        # Index of the next bin with free capacity for every bin (len(timeline) = none).
+        free = occupancy < self.get_capacities(resource_events[resource], timeline)
+        indices = np.where(free, np.arange(len(timeline)), len(timeline))
+        next_free = np.minimum.accumulate(indices[::-1])[::-1]
+        return np.append(next_free, len(timeline))
+
+    def evaluate(self, candidates, info, timeline_start, next_free):
+        # Penalty of all candidates in one vectorized pass (see GeneticPlanner.compute_penalty).
+        bins = len(next_free["intake"]) - 1
+        search_limit = int(np.ceil(7 * 24 / self.resolution))
+        earliest = np.ceil((candidates - timeline_start) / self.resolution - 1e-9)
+        earliest = earliest.astype(int)
+        sent_home = np.zeros(len(candidates), dtype=bool)
+        start_indices = {}
+        for task, duration in self.get_path(info):
+            resource = self.get_ward(info) if task == "nursing" else task
+            start = next_free[resource][np.minimum(earliest, bins)]
+            # Could not find available slot within 7 days
+            sent_home |= (start >= bins) | (start - earliest > search_limit)
+            start_indices[task] = np.where(sent_home, -1, start)
+            earliest = np.where(
+                sent_home, earliest, start + int(np.ceil(duration / self.resolution))
+            )
+
+        last_start = timeline_start + start_indices[task] * self.resolution
+        penalties = np.where(sent_home, 500, last_start - candidates)
+        er_penalty = 10  # Arbitrary penalty for potential ER conflicts
+        return penalties + er_penalty, start_indices
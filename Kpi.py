@@ -0,0 +1,141 @@
+import math
+
+# Scores of the Healthcare Problem computed while the simulation runs, fed by the Logger and
+# the send home decisions of the simulator (same definitions as Event_Logger.compute_scores,
+# without reading the log again).
+
+quantiles = [0.5, 0.9, 0.99]
+
+
+# Streaming quantiles with a relative error of relative_accuracy: values are counted in
+# logarithmic buckets, so the memory only grows with the range of the values
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}  # bucket index -> count (values > 0)
+        self.zeros = 0  # values <= 0 (no negative waiting times or durations)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return max(self.min, 0.0)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # middle of the bucket (gamma^(index-1), gamma^index]
+                value = 2 * self.gamma**index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def get_summary(self):
+        summary = {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+        for q in quantiles:
+            summary[f"p{int(q * 100)}"] = self.quantile(q)
+        return summary
+
+
+class KpiAggregator:
+    def __init__(self):
+        self.open_stays = {}  # id -> stay of a patient that is still in the hospital
+        # minutes from admission to release, EM patients
+        self.er_stays = QuantileSketch()
+        self.processed_stays = QuantileSketch()  # treated patients
+        self.sent_home = 0  # stays released without intake
+        self.waiting_times = {}  # event type -> sketch of start - arrival
+        self.durations = {}  # event type -> sketch of end - start
+        self.send_home_decisions = {"total": 0, "send_home": 0, "reasons": {}}
+
+    # every admission starts a new stay, the release ends it (see compute_scores)
+    def add_event(self, id, event_type, arrival_time, start_time, end_time, metadata):
+        self.waiting_times.setdefault(event_type, QuantileSketch()).add(
+            start_time - arrival_time
+        )
+        self.durations.setdefault(event_type, QuantileSketch()).add(
+            end_time - start_time
+        )
+
+        if event_type == "Admission":
+            self.open_stays[id] = {
+                "arrival_time": arrival_time,
+                "emergency": metadata == "EM",
+                "intake": False,
+            }
+        stay = self.open_stays.get(id)
+        if stay is None:
+            return
+        if event_type == "Intake":
+            stay["intake"] = True
+        if event_type == "Releasing":
+            del self.open_stays[id]
+            time_in_hospital = end_time - stay["arrival_time"]
+            if stay["emergency"]:
+                self.er_stays.add(time_in_hospital)
+            elif stay["intake"]:
+                self.processed_stays.add(time_in_hospital)
+            else:
+                self.sent_home += 1
+
+    def add_send_home_decision(self, id, send_home, reason=None):
+        self.send_home_decisions["total"] += 1
+        if send_home:
+            self.send_home_decisions["send_home"] += 1
+            reasons = self.send_home_decisions["reasons"]
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+    def get_scores(self):
+        return {
+            "er_treatment_score": (
+                self.er_stays.sum / self.er_stays.count if self.er_stays.count else 0.0
+            ),
+            "sent_home_score": float(self.sent_home),
+            "processed_score": (
+                self.processed_stays.sum / self.processed_stays.count
+                if self.processed_stays.count
+                else 0.0
+            ),
+        }
+
+    def get_kpis(self):
+        return {
+            "scores": self.get_scores(),
+            "stays": {
+                "er_treatment": self.er_stays.get_summary(),
+                "processed": self.processed_stays.get_summary(),
+                "open": len(self.open_stays),
+            },
+            "send_home_decisions": {
+                **self.send_home_decisions,
+                "reasons": dict(self.send_home_decisions["reasons"]),
+            },
+            "events": {
+                event_type: {
+                    "waiting_time": self.waiting_times[event_type].get_summary(),
+                    "duration": self.durations[event_type].get_summary(),
+                }
+                for event_type in self.waiting_times
+            },
+        }
@@ -0,0 +1,233 @@
+import heapq, itertools, random, sys
+import numpy as np
+import simulator
+from PatientSpawner import get_arriving_patients, get_random_patient_type
+
+# In-process replacement for the CPEE process model (Main.xml) of the Healthcare Problem:
+# every patient walks through its events by calling the booking logic of the simulator directly,
+# so a whole run needs neither CPEE nor HTTP.
+
+needs_surgery = ["A2", "A3", "A4", "B3", "B4"]
+# share of ER patients that need further treatment after ER_Treatment
+er_diagnosis_probability = 0.5
+
+# durations in hours (mean, standard deviation)
+intake_duration = (1, 1 / 8)
+er_treatment_duration = (2, 1 / 2)
+surgery_durations = {
+    "A2": (1, 1 / 4),
+    "A3": (2, 1 / 2),
+    "A4": (4, 1 / 2),
+    "B3": (4, 1 / 2),
+    "B4": (4, 1),
+}
+nursing_durations = {
+    "A1": (4, 1 / 2),
+    "A2": (8, 2),
+    "A3": (16, 2),
+    "A4": (16, 2),
+    "B1": (8, 2),
+    "B2": (16, 2),
+    "B3": (16, 4),
+    "B4": (16, 4),
+}
+
+
+def sample_minutes(duration):
+    return max(0, int(round(np.random.normal(*duration) * 60)))
+
+
+def get_er_diagnosis():
+    if random.random() >= er_diagnosis_probability:
+        return None
+    return get_random_patient_type(random.choice(["A", "B"]))
+
+
+class LocalDriver:
+    def __init__(self, simulation_end_time, batch=False, watermark=True, scenario=None):
+        self.simulation_end_time = simulation_end_time
+        # scenario of the simulator to drive (default: the one of reset_simulation)
+        self.scenario = scenario if scenario is not None else simulator.get_scenario()
+        # batch mode books all events with the same arrival time at once and plans
+        # all patients sent home in the same step together
+        self.batch = batch
+        self.replans = []  # (patient, arrival_time) to plan in batch mode
+        # declare the arrival of the next new patient as watermark to the simulator
+        self.watermark = watermark
+        self.arrivals = []
+        self.next_arrival = 0
+        # (arrival_time, sequence, patient, event_type, duration, metadata)
+        self.pending = []
+        self.sequence = itertools.count()
+
+    def schedule(self, patient, event_type, arrival_time, duration=0):
+        # CPEE instances also stop once the simulator rejects their arrival time
+        if arrival_time > self.simulation_end_time:
+            return
+        heapq.heappush(
+            self.pending,
+            (
+                arrival_time,
+                next(self.sequence),
+                patient,
+                event_type,
+                duration,
+                patient["metadata"],
+            ),
+        )
+
+    def run(self, arriving_patients):
+        self.arrivals = sorted(arrival_time for _, arrival_time in arriving_patients)
+        for patient_type, arrival_time in arriving_patients:
+            patient = {
+                "id": None,
+                "diagnosis": None if patient_type == "EM" else patient_type,
+                "metadata": patient_type,
+            }
+            self.schedule(patient, simulator.start_event, arrival_time)
+
+        while self.pending:
+            due = [heapq.heappop(self.pending)]
+            while self.batch and self.pending and self.pending[0][0] == due[0][0]:
+                due.append(heapq.heappop(self.pending))
+
+            with self.scenario.lock:
+                reqs = []
+                for arrival_time, _, patient, event_type, duration, metadata in due:
+                    req = self.scenario.new_request(
+                        patient["id"],
+                        event_type,
+                        arrival_time,
+                        duration,
+                        metadata,
+                        self.callback(patient, event_type, arrival_time),
+                    )
+                    if patient["id"] is None:
+                        self.next_arrival += 1
+                    patient["id"] = req["id"]
+                    reqs.append(req)
+
+                for (arrival_time, _, patient, event_type, _, _), response_data in zip(
+                    due, self.scenario.submit_requests(reqs)
+                ):
+                    if not response_data.get("deferred"):
+                        self.complete(patient, event_type, arrival_time, response_data)
+                if self.watermark:
+                    self.scenario.advance_watermark(self.get_watermark())
+                simulator.send_callbacks(self.scenario.dispatch_waiting_requests())
+                if self.replans:
+                    self.plan_replans()
+
+    def plan_replans(self):
+        replanned_times = self.scenario.plan_arrivals(
+            [
+                (patient["id"], arrival_time, patient["metadata"])
+                for patient, arrival_time in self.replans
+            ]
+        )
+        for patient, _ in self.replans:
+            self.schedule(
+                patient, simulator.start_event, replanned_times[patient["id"]]
+            )
+        self.replans = []
+
+    def get_watermark(self):
+        if self.next_arrival < len(self.arrivals):
+            return self.arrivals[self.next_arrival]
+        return float("inf")  # all patients have arrived
+
+    def callback(self, patient, event_type, arrival_time):
+        return lambda response_data: self.complete(
+            patient, event_type, arrival_time, response_data
+        )
+
+    def complete(self, patient, event_type, arrival_time, response_data):
+        diagnosis = patient["diagnosis"]
+
+        if event_type == simulator.start_event:
+            if response_data.get("send_home"):
+                patient["replan"] = True
+                self.schedule(patient, "Releasing", arrival_time)
+            elif diagnosis is None:
+                self.schedule(
+                    patient,
+                    "ER_Treatment",
+                    arrival_time,
+                    sample_minutes(er_treatment_duration),
+                )
+            else:
+                self.schedule(
+                    patient, "Intake", arrival_time, sample_minutes(intake_duration)
+                )
+            return
+
+        if event_type == "Releasing":
+            if not patient.pop("replan", False):
+                return
+            if self.batch:
+                self.replans.append((patient, arrival_time))
+                return
+            replanned_time = self.scenario.plan_arrival(
+                patient["id"], arrival_time, patient["metadata"]
+            )
+            self.schedule(patient, simulator.start_event, replanned_time)
+            return
+
+        end_time = response_data["end_time"]
+        if event_type == "ER_Treatment":
+            diagnosis = get_er_diagnosis()
+            if diagnosis is None:
+                self.schedule(patient, "Releasing", end_time)
+                return
+            patient["diagnosis"] = diagnosis
+            patient["metadata"] = f"EM-{diagnosis}"
+
+        if event_type in ["ER_Treatment", "Intake"] and diagnosis in needs_surgery:
+            self.schedule(
+                patient,
+                "Surgery",
+                end_time,
+                sample_minutes(surgery_durations[diagnosis]),
+            )
+        elif event_type in ["ER_Treatment", "Intake", "Surgery"]:
+            self.schedule(
+                patient,
+                f"Nursing_{diagnosis[0]}",
+                end_time,
+                sample_minutes(nursing_durations[diagnosis]),
+            )
+        else:
+            self.schedule(patient, "Releasing", end_time)
+
+
+def run_simulation(
+    simulation_end_time,
+    log_file="log.csv",
+    new_planner=None,
+    batch=False,
+    watermark=True,
+    config=None,
+    arriving_patients=None,
+    batch_commit=False,
+):
+    scenario = simulator.reset_simulation(
+        simulation_end_time, log_file, config, new_planner, batch_commit=batch_commit
+    )
+    if arriving_patients is None:
+        arriving_patients = get_arriving_patients(simulation_end_time)
+    LocalDriver(simulation_end_time, batch, watermark, scenario).run(arriving_patients)
+    return scenario
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Bitte geben Sie die Simulationsdauer in Minuten an.")
+        sys.exit(1)
+    scenario = run_simulation(
+        int(sys.argv[1]),
+        batch="batch" in sys.argv[2:],
+        watermark="no_watermark" not in sys.argv[2:],
+        batch_commit="batch_commit" in sys.argv[2:],
+    )
+    # scores of the streaming KPIs, same as compute_scores("log.csv")
+    print(scenario.kpis.get_scores())
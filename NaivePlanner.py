@@ -1,24 +1,34 @@
 from datetime import datetime, timedelta
+from ProblemConfig import compile_config
 
 
 class NaivePlanner:
-    def __init__(self, simulation_start):
+    def __init__(self, simulation_start, problem=None):
         self.simulation_start = simulation_start
+        self.problem = problem if problem is not None else compile_config()
+        # plan() searches the next working hour of the intake
+        if not any(self.problem.get_event("Intake").working_hours):
+            raise ValueError("Intake has no working hours")
 
     def plan(self, arrival_time):
         arrival_datetime = self.simulation_start + timedelta(minutes=arrival_time)
         replanned_datetime = arrival_datetime + timedelta(hours=24)  # next day
 
         # make sure its a working day and working hours
-        while replanned_datetime.weekday() >= 5 or not (
-            8 <= replanned_datetime.hour < 17
-        ):
-            # move to the start of the next day at 8:00
+        if not self.is_working_hour(replanned_datetime):
+            # move to the start of the next day, then hour by hour to the first working hour
             replanned_datetime += timedelta(days=1)
-            replanned_datetime = replanned_datetime.replace(hour=8, minute=0)
+            replanned_datetime = replanned_datetime.replace(hour=0, minute=0)
+            while not self.is_working_hour(replanned_datetime):
+                replanned_datetime += timedelta(hours=1)
 
         # calculate minutes from simulation start to the adjusted replanned time
         replanned_time = int(
             (replanned_datetime - self.simulation_start).total_seconds() // 60
         )
         return replanned_time
+
+    def is_working_hour(self, replanned_datetime):
+        return self.problem.is_working_hour(
+            "Intake", (replanned_datetime - self.simulation_start).total_seconds() / 60
+        )
@@ -0,0 +1,119 @@
+import bisect, heapq
+from collections import Counter
+
+# Running occupancy and queue length of one event, used for the send home decision
+# of the Healthcare Problem instead of scanning all bookings and waiting requests.
+
+
+class OccupancyTracker:
+    def __init__(self):
+        # number of bookings with start_time <= clock < end_time
+        self.clock = float("-inf")
+        self.occupancy = 0
+        self.starts = []  # heap of (start_time, end_time) for bookings after the clock
+        self.ends = []  # heap of end times of the bookings counted in occupancy
+        self.waiting_arrivals = []  # sorted arrival times of the waiting requests
+
+    def add_booking(self, start_time, end_time):
+        if start_time > self.clock:
+            heapq.heappush(self.starts, (start_time, end_time))
+        elif end_time > self.clock:
+            self.occupancy += 1
+            heapq.heappush(self.ends, end_time)
+
+    def advance(self, time):
+        self.clock = time
+        while self.starts and self.starts[0][0] <= time:
+            start_time, end_time = heapq.heappop(self.starts)
+            self.occupancy += 1
+            heapq.heappush(self.ends, end_time)
+        while self.ends and self.ends[0] <= time:
+            heapq.heappop(self.ends)
+            self.occupancy -= 1
+
+    # the clock only moves forward, earlier times (e.g. replanned patients) fall back to a scan
+    def get_occupancy(self, time, bookings):
+        if time < self.clock:
+            return len([b for b in bookings if b["start_time"] <= time < b["end_time"]])
+        self.advance(time)
+        return self.occupancy
+
+    def add_waiting(self, arrival_time):
+        bisect.insort(self.waiting_arrivals, arrival_time)
+
+    def remove_waiting(self, arrival_time):
+        del self.waiting_arrivals[
+            bisect.bisect_left(self.waiting_arrivals, arrival_time)
+        ]
+
+    # number of waiting requests that arrived until time
+    def get_waiting(self, time):
+        return bisect.bisect_right(self.waiting_arrivals, time)
+
+
+# End times of the active bookings of one event (the current stage of each patient), for the
+# dependency check of can_process_request instead of scanning all active bookings.
+class ActiveEnds:
+    def __init__(self):
+        self.heap = []  # (end_time, id), entries of removed bookings are dropped lazily
+        self.end_times = {}  # id -> Counter of the end times of its active bookings
+        self.stale = 0  # removed entries still in the heap
+
+    def __contains__(self, id):
+        return id in self.end_times
+
+    def add(self, id, end_time):
+        heapq.heappush(self.heap, (end_time, id))
+        self.end_times.setdefault(id, Counter())[end_time] += 1
+
+    # removes all active bookings of id, or only the one with end_time
+    def remove(self, id, end_time=None):
+        if id not in self.end_times:
+            return
+        if end_time is None:
+            self.stale += sum(self.end_times.pop(id).values())
+        else:
+            counter = self.end_times[id]
+            counter[end_time] -= 1
+            if counter[end_time] <= 0:
+                del counter[end_time]
+            if not counter:
+                del self.end_times[id]
+            self.stale += 1
+        if self.stale > len(self.heap) // 2:
+            self.rebuild()
+
+    def rebuild(self):
+        self.heap = [
+            (end_time, id)
+            for id, counter in self.end_times.items()
+            for end_time, count in counter.items()
+            for _ in range(count)
+        ]
+        heapq.heapify(self.heap)
+        self.stale = 0
+
+    def is_active(self, entry):
+        end_time, id = entry
+        return self.end_times.get(id, {}).get(end_time, 0) > 0
+
+    def get_earliest_end(self):
+        while self.heap and not self.is_active(self.heap[0]):
+            heapq.heappop(self.heap)
+            self.stale -= 1
+        return self.heap[0][0] if self.heap else float("inf")
+
+    # whether an active booking of another patient ends before time; only the subtrees of the
+    # heap with earlier end times are visited, usually just the root
+    def ends_before(self, time, exclude_id):
+        if self.get_earliest_end() >= time:
+            return False
+        stack = [0]
+        while stack:
+            index = stack.pop()
+            if index >= len(self.heap) or self.heap[index][0] >= time:
+                continue
+            if self.heap[index][1] != exclude_id and self.is_active(self.heap[index]):
+                return True
+            stack.extend([2 * index + 1, 2 * index + 2])
+        return False
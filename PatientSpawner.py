@@ -1,25 +1,29 @@
-import requests, sys, random, datetime
+import requests, sys, random, datetime, json, time
 import numpy as np
+from ProblemConfig import compile_config
 
 base_url = "https://cpee.org/flow/start/url/"
 init_data = {
     "behavior": "fork_running",
     "url": "https://cpee.org/hub/server/Teaching.dir/Prak.dir/Challengers.dir/Julian_Simon.dir/Main.xml",
 }
+simulator_url = "http://[::1]:57874/incoming_events"
+watermark_url = "http://[::1]:57874/watermark"
+batch_size = 500
+# arrival traces: one record per patient, sorted by arrival time
+trace_dtype = np.dtype([("patient_type", "U2"), ("arrival_time", np.int64)])
 
-if len(sys.argv) < 2:
-    print("Bitte geben Sie die Simulationsdauer in Minuten an.")
-    sys.exit(1)
-simulation_end_time = int(sys.argv[1])
+
+problem = compile_config()
 
 
 def minutes_to_datetime(minutes):
     return datetime.datetime(2018, 1, 1) + datetime.timedelta(minutes=minutes)
 
 
+# working hours are the opening hours of the intake
 def is_working_hours(arrival_time):
-    dt = minutes_to_datetime(arrival_time)
-    return dt.weekday() < 5 and 8 <= dt.hour < 17  # Monday=0, Sunday=6
+    return problem.is_working_hour("Intake", arrival_time)
 
 
 patient_types_A = ["A1", "A2", "A3", "A4"]
@@ -40,7 +44,7 @@ def get_random_patient_type(category):
         raise ValueError("Invalid patient category")
 
 
-def get_patients(patient_category):
+def get_patients(patient_category, simulation_end_time):
     arrival_time = 0
     patients = []
 
@@ -63,21 +67,151 @@ def get_patients(patient_category):
     return patients
 
 
-arriving_patients = get_patients("A") + get_patients("B") + get_patients("EM")
-arriving_patients.sort(key=lambda x: x[1])
+def get_arriving_patients(simulation_end_time):
+    arriving_patients = (
+        get_patients("A", simulation_end_time)
+        + get_patients("B", simulation_end_time)
+        + get_patients("EM", simulation_end_time)
+    )
+    arriving_patients.sort(key=lambda x: x[1])
+    return arriving_patients
+
+
+# writes the arrivals once to a memory-mappable .npy file, e.g. for the SweepRunner
+def write_arrival_trace(arriving_patients, trace_file):
+    trace = np.lib.format.open_memmap(
+        trace_file, mode="w+", dtype=trace_dtype, shape=(len(arriving_patients),)
+    )
+    trace[:] = arriving_patients
+    trace.flush()
+    del trace
+
+
+# all readers share the pages of the file instead of generating their own arrivals
+def read_arrival_trace(trace_file):
+    return np.load(trace_file, mmap_mode="r")
+
+
+def get_trace_patients(trace_file):
+    trace = read_arrival_trace(trace_file)
+    return list(zip(trace["patient_type"].tolist(), trace["arrival_time"].tolist()))
+
 
-print("Sending requests...")
-for patient in arriving_patients:
+# no new patient arrives before time (the arrival schedule is known in advance)
+def send_watermark(time):
+    try:
+        requests.post(watermark_url, data={"Time": time})
+    except Exception as e:
+        print(f"Error in sending watermark {time}: {e}")
+
+
+# client mode: books the admissions directly at the simulator, many per request
+def send_admission_batches(arriving_patients):
+    for i in range(0, len(arriving_patients), batch_size):
+        batch = [
+            (patient_type, arrival_time, None)
+            for patient_type, arrival_time in arriving_patients[i : i + batch_size]
+        ]
+        # admissions shed by the simulator (queue full) are sent again after Retry-After
+        # with the id assigned by the simulator, before the watermark passes them
+        while batch:
+            batch = send_admission_batch(batch)
+        if i + batch_size < len(arriving_patients):
+            send_watermark(arriving_patients[i + batch_size][1])
+    send_watermark("inf")  # all patients have arrived
+
+
+# the CPEE process continues the stay after the Admission already booked in batch mode
+def start_admitted_instance(patient_type, arrival_time, admission):
     data = {
         **init_data,
-        "init": f'{{"patient_type":"{patient[0]}","time_now":"{patient[1]}"}}',
+        "init": json.dumps(
+            {
+                "patient_id": str(admission["id"]),
+                "patient_type": patient_type,
+                "time_now": str(arrival_time),
+                "admission": admission,
+            }
+        ),
     }
     try:
         response = requests.post(base_url, data=data)
         response_json = response.json()
         print(
-            f"Request for CPEE: {response_json.get('CPEE-INSTANCE')} - Status Code: {response.status_code} - Time: {patient[1]} - Type: {patient[0]}"
+            f"Patient {admission['id']} admitted at CPEE: {response_json.get('CPEE-INSTANCE')} - Status Code: {response.status_code}"
+        )
+    except Exception as e:
+        print(f"Error in starting the stay of patient {admission['id']}: {e}")
+
+
+# batch of (patient_type, arrival_time, id or None), returns the shed admissions of the batch
+def send_admission_batch(batch):
+    body = "\n".join(
+        json.dumps(
+            {
+                "ID": id,
+                "Event_Type": "Admission",
+                "Arrival_Time": arrival_time,
+                "Duration": 0,
+                "Metadata": patient_type,
+            }
+        )
+        for patient_type, arrival_time, id in batch
+    )
+    try:
+        response = requests.post(simulator_url, data=body)
+        results = response.json().get("results", [])
+        shed = [
+            (patient_type, arrival_time, r["id"])
+            for (patient_type, arrival_time, _), r in zip(batch, results)
+            if r.get("shed")
+        ]
+        print(
+            f"Batch of {len(batch)} admissions - Status Code: {response.status_code} - Time: {batch[0][1]} to {batch[-1][1]} - Deferred: {sum(1 for r in results if r.get('deferred'))} - Shed: {len(shed)}"
         )
     except Exception as e:
-        print(f"Error in request for patient {patient}: {e}")
-print("All requests sent.")
+        print(f"Error in batch starting at time {batch[0][1]}: {e}")
+        return []
+    for (patient_type, arrival_time, _), result in zip(batch, results):
+        if not result.get("shed") and "error" not in result:
+            start_admitted_instance(patient_type, arrival_time, result)
+    if shed:
+        time.sleep(float(response.headers.get("Retry-After", 1)))
+    return shed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Bitte geben Sie die Simulationsdauer in Minuten an.")
+        sys.exit(1)
+    simulation_end_time = int(sys.argv[1])
+
+    arriving_patients = get_arriving_patients(simulation_end_time)
+
+    if "trace" in sys.argv[2:]:
+        trace_file = sys.argv[sys.argv.index("trace") + 1]
+        write_arrival_trace(arriving_patients, trace_file)
+        print(f"{len(arriving_patients)} Ankünfte in {trace_file} geschrieben.")
+        sys.exit(0)
+
+    if "batch" in sys.argv[2:]:
+        print("Sending admission batches...")
+        send_admission_batches(arriving_patients)
+        print("All batches sent.")
+        sys.exit(0)
+
+    print("Sending requests...")
+    for patient in arriving_patients:
+        data = {
+            **init_data,
+            "init": f'{{"patient_type":"{patient[0]}","time_now":"{patient[1]}"}}',
+        }
+        try:
+            response = requests.post(base_url, data=data)
+            response_json = response.json()
+            print(
+                f"Request for CPEE: {response_json.get('CPEE-INSTANCE')} - Status Code: {response.status_code} - Time: {patient[1]} - Type: {patient[0]}"
+            )
+        except Exception as e:
+            print(f"Error in request for patient {patient}: {e}")
+    print("All requests sent.")
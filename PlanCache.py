@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+# Bounded LRU cache for planner results. Keys contain a version of the state the planner plans
+# against, bumped by the simulator on every booking change the planner sees and whenever a
+# returned plan is committed, so stale plans are never hit and simply age out of the cache.
+
+
+class PlanCache:
+    def __init__(self, max_entries=1024, time_quantum=60):
+        self.max_entries = max_entries
+        self.time_quantum = time_quantum  # minutes per current time bucket
+        self.entries = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_key(self, planner_name, diagnosis, current_time):
+        return (
+            planner_name,
+            diagnosis,
+            int(current_time // self.time_quantum),
+            self.version,
+        )
+
+    # valid: optional check of a cached value for the request, a failed check is a miss
+    def get(self, key, valid=None):
+        if key not in self.entries or (valid and not valid(self.entries[key])):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # any change of the bookings or of the planner schedule makes all entries stale
+    def invalidate(self):
+        self.version += 1
+        self.invalidations += 1
+
+    def get_stats(self):
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
@@ -0,0 +1,177 @@
+import hashlib, json, os, pickle
+from datetime import datetime
+from typing import Dict, NamedTuple, Tuple
+import HealthcareProblem
+
+# Compiles a problem config (see HealthcareProblem.events) once into an immutable model.
+# Capacities are stored per hour of the week (0 = Monday 0:00), so lookups need no datetime math.
+
+HOURS_PER_WEEK = 7 * 24
+COMPILER_VERSION = 4
+default_cache_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "__pycache__"
+)
+
+
+class CompiledEvent(NamedTuple):
+    id: int
+    name: str
+    dependencies: Tuple[str, ...]
+    # ids of the dependencies, closest upstream stage (latest in topological order) first
+    dependency_ids: Tuple[int, ...]
+    capacities: Tuple[float, ...]  # capacity per hour of the week
+    working_hours: Tuple[bool, ...]  # capacity > 0 per hour of the week
+
+
+class CompiledConfig(NamedTuple):
+    event_names: Tuple[str, ...]  # index = event id
+    event_ids: Dict[str, int]  # event name -> event id (lookups on the hot path)
+    events: Tuple[CompiledEvent, ...]
+    start_offset: int  # hour of the week at simulation time 0
+    content_hash: str
+
+    def event_id(self, event_type):
+        return self.event_ids[event_type]
+
+    def get_event(self, event_type):
+        return self.events[self.event_ids[event_type]]
+
+    def hour_of_week(self, minutes):
+        return (int(minutes // 60) + self.start_offset) % HOURS_PER_WEEK
+
+    def get_capacity(self, event_type, minutes):
+        return self.get_event(event_type).capacities[self.hour_of_week(minutes)]
+
+    def is_working_hour(self, event_type, minutes):
+        return self.get_event(event_type).working_hours[self.hour_of_week(minutes)]
+
+
+def validate_config(config):
+    if not isinstance(config, dict) or not config:
+        raise ValueError("Config must be a non-empty dict of events")
+    for event_type, event in config.items():
+        for key in ["capacity", "dependencies", "bookings", "active_bookings"]:
+            if key not in event:
+                raise ValueError(f"Event {event_type} is missing the key {key}")
+        for rule in event["capacity"]:
+            if not rule["capacity"] >= 0:
+                raise ValueError(f"Event {event_type} has a negative capacity")
+            if not set(rule["days"]) <= set(range(7)):
+                raise ValueError(f"Event {event_type} has days outside of 0-6")
+            if not 0 <= rule["start_hour"] < rule["end_hour"] <= 24:
+                raise ValueError(f"Event {event_type} has an invalid hour range")
+        for dependency in event["dependencies"]:
+            if dependency not in config:
+                raise ValueError(
+                    f"Event {event_type} depends on the unknown event {dependency}"
+                )
+
+
+# Kahn's algorithm, events without open dependencies in config order
+def get_topological_order(config):
+    remaining = {
+        event_type: set(event["dependencies"]) for event_type, event in config.items()
+    }
+    order = []
+    while remaining:
+        ready = [event_type for event_type, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(
+                f"Cyclic dependencies between the events {list(remaining)}"
+            )
+        for event_type in ready:
+            order.append(event_type)
+            del remaining[event_type]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return order
+
+
+def get_content_hash(config, simulation_start):
+    # bookings are simulation state, not configuration
+    content = {
+        event_type: {
+            "capacity": event["capacity"],
+            "dependencies": event["dependencies"],
+        }
+        for event_type, event in config.items()
+    }
+    content = json.dumps(
+        [COMPILER_VERSION, str(simulation_start), content], sort_keys=True
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def build_config(config, simulation_start, content_hash):
+    validate_config(config)
+    event_names = tuple(config)
+    topological_order = get_topological_order(config)
+    events = []
+    for event_id, event_type in enumerate(event_names):
+        # capacity rules are prioritized from top to bottom, default is 0
+        capacities = []
+        for hour in range(HOURS_PER_WEEK):
+            capacity = 0
+            for rule in config[event_type]["capacity"]:
+                if (
+                    hour // 24 in rule["days"]
+                    and rule["start_hour"] <= hour % 24 < rule["end_hour"]
+                ):
+                    capacity = rule["capacity"]
+                    break
+            capacities.append(capacity)
+        dependencies = tuple(config[event_type]["dependencies"])
+        dependency_ids = tuple(
+            sorted(
+                (event_names.index(dependency) for dependency in dependencies),
+                key=lambda i: topological_order.index(event_names[i]),
+                reverse=True,
+            )
+        )
+        events.append(
+            CompiledEvent(
+                event_id,
+                event_type,
+                dependencies,
+                dependency_ids,
+                tuple(capacities),
+                tuple(capacity > 0 for capacity in capacities),
+            )
+        )
+    start_offset = simulation_start.weekday() * 24 + simulation_start.hour
+    event_ids = {
+        event_type: event_id for event_id, event_type in enumerate(event_names)
+    }
+    return CompiledConfig(
+        event_names, event_ids, tuple(events), start_offset, content_hash
+    )
+
+
+def compile_config(
+    config=None, simulation_start=datetime(2018, 1, 1), cache_dir=default_cache_dir
+):
+    if config is None:
+        config = HealthcareProblem.events
+    content_hash = get_content_hash(config, simulation_start)
+    cache_file = (
+        os.path.join(cache_dir, f"config.{content_hash}.pickle") if cache_dir else None
+    )
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass  # stale or broken cache file, compile again
+
+    compiled = build_config(config, simulation_start, content_hash)
+    if cache_file:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first, parallel runs may compile at the same time
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as file:
+                pickle.dump(compiled, file)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # caching is only an optimization
+    return compiled
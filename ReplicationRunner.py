@@ -0,0 +1,117 @@
+import contextlib, math, os, random, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from Event_Logger import compute_scores
+from GeneticPlanner import GeneticPlanner
+from GridPlanner import GridPlanner
+from LocalDriver import run_simulation
+
+# Runs independently seeded replications of the Healthcare Problem in parallel processes
+# and aggregates their scores with confidence intervals.
+
+planners = {
+    "naive": None,  # simulator default (NaivePlanner)
+    "genetic": GeneticPlanner,
+    "grid": GridPlanner,
+}
+
+# two-sided 95% quantiles of the t-distribution by degrees of freedom (normal beyond 30)
+t_quantiles = {
+    1: 12.706,
+    2: 4.303,
+    3: 3.182,
+    4: 2.776,
+    5: 2.571,
+    6: 2.447,
+    7: 2.365,
+    8: 2.306,
+    9: 2.262,
+    10: 2.228,
+    15: 2.131,
+    20: 2.086,
+    25: 2.060,
+    30: 2.042,
+}
+
+
+def get_t_quantile(degrees_of_freedom):
+    # fall back to the next smaller tabulated value (slightly conservative)
+    tabulated = [df for df in t_quantiles if df <= degrees_of_freedom]
+    return t_quantiles[max(tabulated)] if degrees_of_freedom <= 30 else 1.96
+
+
+def run_replication(seed, simulation_end_time, planner_name):
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.time()
+    with tempfile.TemporaryDirectory() as log_dir:
+        log_file = os.path.join(log_dir, "log.csv")
+        # each replication prints its send home decisions, keep the runner output readable
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run_simulation(simulation_end_time, log_file, planners[planner_name])
+        scores = compute_scores(log_file)
+    return {"seed": seed, "duration": time.time() - start, "scores": scores}
+
+
+def aggregate_scores(results):
+    aggregated = {}
+    for score in results[0]["scores"]:
+        values = [result["scores"][score] for result in results]
+        n = len(values)
+        mean = sum(values) / n
+        if n > 1:
+            std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+            half_width = get_t_quantile(n - 1) * std / math.sqrt(n)
+        else:
+            std, half_width = 0.0, float("nan")
+        aggregated[score] = {
+            "mean": mean,
+            "std": std,
+            "ci_low": mean - half_width,
+            "ci_high": mean + half_width,
+        }
+    return aggregated
+
+
+def run_replications(
+    simulation_end_time, replications, planner_name="naive", workers=None, base_seed=0
+):
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                run_replication, base_seed + i, simulation_end_time, planner_name
+            )
+            for i in range(replications)
+        ]
+        # stream results in order of completion
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(
+                f"Replication {result['seed']} finished after {result['duration']:.2f} Sekunden: {result['scores']}"
+            )
+    return aggregate_scores(results)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Bitte geben Sie die Simulationsdauer in Minuten an.")
+        sys.exit(1)
+    simulation_end_time = int(sys.argv[1])
+    replications = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    planner_name = sys.argv[3] if len(sys.argv) > 3 else "naive"
+    if planner_name not in planners:
+        print(f"Unbekannter Planner {planner_name}, erlaubt sind: {list(planners)}")
+        sys.exit(1)
+
+    start = time.time()
+    aggregated = run_replications(simulation_end_time, replications, planner_name)
+    print("--------------------------------")
+    print(
+        f"Die {replications} Replikationen haben {time.time() - start:.2f} Sekunden gedauert."
+    )
+    for score, stats in aggregated.items():
+        print(
+            f"{score}: {stats['mean']:.2f} (95%-KI [{stats['ci_low']:.2f}, {stats['ci_high']:.2f}], Std {stats['std']:.2f})"
+        )
@@ -0,0 +1,169 @@
+import contextlib, copy, itertools, os, random, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import HealthcareProblem
+from Event_Logger import compute_scores, compute_waiting_times
+from LocalDriver import run_simulation
+from PatientSpawner import get_trace_patients
+from ReplicationRunner import aggregate_scores, planners
+
+# Evaluates a grid of capacity overrides of the Healthcare Problem in parallel processes.
+# All variants read the same memory-mapped arrival trace (PatientSpawner.py ... trace) and
+# use the same seeds, so differences between variants come from the capacities only.
+
+
+# "Surgery=5,6" -> ("Surgery", [5, 6])
+def parse_override(argument):
+    event_type, values = argument.split("=", 1)
+    if event_type not in HealthcareProblem.events:
+        raise ValueError(f"Unbekanntes Event {event_type}")
+    return event_type, [int(value) for value in values.split(",")]
+
+
+def get_variants(overrides):
+    event_types = [event_type for event_type, _ in overrides]
+    return [
+        dict(zip(event_types, capacities))
+        for capacities in itertools.product(*[values for _, values in overrides])
+    ]
+
+
+# the override replaces the capacity of the first (highest priority) rule of the event,
+# e.g. the regular opening hours of the Surgery
+def get_config(variant):
+    config = copy.deepcopy(HealthcareProblem.events)
+    for event_type, capacity in variant.items():
+        config[event_type]["capacity"][0]["capacity"] = capacity
+    return config
+
+
+def run_variant(trace_file, variant, seed, simulation_end_time, planner_name):
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.time()
+    arriving_patients = get_trace_patients(trace_file)
+    with tempfile.TemporaryDirectory() as log_dir:
+        log_file = os.path.join(log_dir, "log.csv")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run_simulation(
+                simulation_end_time,
+                log_file,
+                planners[planner_name],
+                config=get_config(variant),
+                arriving_patients=arriving_patients,
+            )
+        scores = compute_scores(log_file)
+        waiting_times = compute_waiting_times(log_file)
+    return {
+        "variant": variant,
+        "seed": seed,
+        "duration": time.time() - start,
+        "scores": scores,
+        "waiting_times": waiting_times,
+    }
+
+
+def run_sweep(
+    trace_file,
+    simulation_end_time,
+    overrides,
+    replications=1,
+    planner_name="naive",
+    workers=None,
+):
+    variants = get_variants(overrides)
+    results = {index: [] for index in range(len(variants))}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                run_variant,
+                trace_file,
+                variant,
+                seed,
+                simulation_end_time,
+                planner_name,
+            ): index
+            for index, variant in enumerate(variants)
+            for seed in range(replications)
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]].append(result)
+            print(
+                f"Variante {result['variant']} (Seed {result['seed']}) fertig nach {result['duration']:.2f} Sekunden"
+            )
+
+    table = []
+    for index, variant in enumerate(variants):
+        runs = results[index]
+        event_types = sorted({e for run in runs for e in run["waiting_times"]})
+        table.append(
+            {
+                "variant": variant,
+                "scores": aggregate_scores(runs),
+                "waiting_times": {
+                    event_type: sum(
+                        run["waiting_times"].get(event_type, 0) for run in runs
+                    )
+                    / len(runs)
+                    for event_type in event_types
+                },
+            }
+        )
+    return table
+
+
+def print_table(table):
+    scores = list(table[0]["scores"])
+    # only events that had to wait in at least one variant
+    event_types = [
+        event_type
+        for event_type in HealthcareProblem.events
+        if any(row["waiting_times"].get(event_type, 0) > 0 for row in table)
+    ]
+    header = ["Variante"] + scores + [f"wait_{e}" for e in event_types]
+    rows = [
+        [", ".join(f"{e}={c}" for e, c in row["variant"].items())]
+        + [f"{row['scores'][score]['mean']:.2f}" for score in scores]
+        + [f"{row['waiting_times'].get(e, 0):.2f}" for e in event_types]
+        for row in table
+    ]
+    widths = [max(len(line[i]) for line in [header] + rows) for i in range(len(header))]
+    for line in [header] + rows:
+        print(" | ".join(value.ljust(width) for value, width in zip(line, widths)))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print(
+            "Bitte geben Sie die Trace-Datei, die Simulationsdauer in Minuten und mindestens eine Kapazitätsvariante an (z. B. Surgery=5,6 Nursing_A=30,35, optional replications=3 planner=grid)."
+        )
+        sys.exit(1)
+    trace_file = sys.argv[1]
+    simulation_end_time = int(sys.argv[2])
+    overrides = []
+    replications, planner_name = 1, "naive"
+    try:
+        for arg in sys.argv[3:]:
+            if arg.startswith("replications="):
+                replications = int(arg.split("=", 1)[1])
+            elif arg.startswith("planner="):
+                planner_name = arg.split("=", 1)[1]
+            else:
+                overrides.append(parse_override(arg))
+    except ValueError as e:
+        print(f"Ungültiges Argument: {e}")
+        sys.exit(1)
+    if planner_name not in planners:
+        print(f"Unbekannter Planner {planner_name}, erlaubt sind: {list(planners)}")
+        sys.exit(1)
+
+    start = time.time()
+    table = run_sweep(
+        trace_file, simulation_end_time, overrides, replications, planner_name
+    )
+    print("--------------------------------")
+    print(
+        f"Die {len(table)} Varianten haben {time.time() - start:.2f} Sekunden gedauert."
+    )
+    print_table(table)
@@ -0,0 +1,25 @@
+import json
+
+# Compact append-only trace of the inbound traffic of one scenario (JSON lines), replayed by
+# TraceReplay.py. The first record describes the scenario, every further record is
+# [kind, args, result] in the order the scenario lock was taken.
+
+
+class TraceRecorder:
+    def __init__(self, trace_file, header):
+        self.trace_file = trace_file
+        self.file = open(trace_file, mode="w")
+        self.write("scenario", header)
+
+    def write(self, kind, args, result=None):
+        self.file.write(json.dumps([kind, args, result], separators=(",", ":")) + "\n")
+        # flushed per record, so the trace survives a crash of the simulator
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(trace_file):
+    with open(trace_file, mode="r") as file:
+        return [json.loads(line) for line in file if line.strip()]
@@ -0,0 +1,134 @@
+import contextlib, filecmp, json, os, sys, tempfile, time
+import simulator
+from Trace import read_trace
+
+# Replays a trace of a scenario (simulator.py ... trace=<file>) as fast as possible directly
+# against the booking logic, without HTTP and CPEE. Reports the time per kind of call and
+# checks the responses, callbacks and log.csv against the recording, so a trace serves as
+# benchmark and as regression test. Plans of the GeneticPlanner are random and not reproduced.
+
+planner_names = {
+    "NaivePlanner": "naive",
+    "GeneticPlanner": "genetic",
+    "GridPlanner": "grid",
+}
+
+
+def create_scenario(header, log_file):
+    config = {
+        event_type: {**event, "bookings": [], "active_bookings": []}
+        for event_type, event in header["config"].items()
+    }
+    return simulator.Scenario(
+        header["simulation_end"],
+        log_file,
+        config,
+        simulator.planners[planner_names[header["planner"]]],
+        header["queue_limit"],
+        header["batch_commit"],
+        shed_timeout=None,  # given up shed admissions are replayed from the trace
+    )
+
+
+# results as they would have been recorded (tuples become lists, dict keys strings)
+def normalize(result):
+    return json.loads(json.dumps(result))
+
+
+def replay(trace_file, log_file):
+    records = read_trace(trace_file)
+    header = records[0][1]
+    scenario = create_scenario(header, log_file)
+
+    # callbacks go to a list instead of CPEE
+    sent_callbacks = []
+
+    def get_callback(url):
+        return lambda response_data: sent_callbacks.append([[url], response_data])
+
+    phases = {}  # kind -> [calls, seconds]
+    mismatches = []  # indices of the records with a different result
+    recorded_callbacks = []
+    start = time.perf_counter()
+    # the booking logic prints its send home decisions
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for index, (kind, args, result) in enumerate(records[1:], 1):
+            if kind == "callback":
+                recorded_callbacks.append([args, result])
+                continue
+            phase_start = time.perf_counter()
+            if kind == "event":
+                replayed = list(scenario.book(*args[:5], get_callback(args[5])))
+            elif kind == "events":
+                replayed = scenario.book_batch(
+                    [
+                        {**item, "cpee_callback": get_callback(item["cpee_callback"])}
+                        for item in args
+                    ]
+                )
+            elif kind == "plan":
+                replayed = scenario.plan_arrival(*args)
+            elif kind == "plans":
+                replayed = scenario.plan_arrivals([tuple(patient) for patient in args])
+            elif kind == "watermark":
+                scenario.advance_watermark(args[0])
+                simulator.send_callbacks(scenario.dispatch_waiting_requests())
+                replayed = None
+            elif kind == "shed_expired":
+                scenario.expire_shed_arrivals(args)
+                replayed = None
+            elif kind == "dispatch":
+                simulator.send_callbacks(scenario.dispatch_waiting_requests())
+                replayed = None
+            else:
+                raise ValueError(f"Unknown record {kind} in line {index + 1}")
+            phase = phases.setdefault(kind, [0, 0.0])
+            phase[0] += 1
+            phase[1] += time.perf_counter() - phase_start
+            if normalize(replayed) != result:
+                mismatches.append(index)
+
+    return {
+        "duration": time.perf_counter() - start,
+        "phases": phases,
+        "mismatches": mismatches,
+        "callbacks": len(sent_callbacks),
+        "callbacks_identical": normalize(sent_callbacks) == recorded_callbacks,
+        "recorded_log_file": header["log_file"],
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Bitte geben Sie die Trace-Datei an (optional die log.csv der Aufnahme).")
+        sys.exit(1)
+    trace_file = sys.argv[1]
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        log_file = os.path.join(log_dir, "log.csv")
+        result = replay(trace_file, log_file)
+        recorded_log_file = (
+            sys.argv[2] if len(sys.argv) > 2 else result["recorded_log_file"]
+        )
+        log_identical = os.path.exists(recorded_log_file) and filecmp.cmp(
+            log_file, recorded_log_file, shallow=False
+        )
+
+    print(f"Replay in {result['duration']:.3f} Sekunden:")
+    for kind, (calls, seconds) in result["phases"].items():
+        print(
+            f"{kind}: {calls} Aufrufe, {seconds:.3f} Sekunden ({seconds / calls * 1e6:.0f} µs je Aufruf)"
+        )
+    print(
+        f"Abweichende Antworten: {len(result['mismatches'])} {result['mismatches'][:10]}"
+    )
+    print(
+        f"Callbacks: {result['callbacks']} ({'identisch' if result['callbacks_identical'] else 'abweichend'})"
+    )
+    print(
+        f"log.csv ({recorded_log_file}): {'identisch' if log_identical else 'abweichend'}"
+    )
+    identical = (
+        log_identical and not result["mismatches"] and result["callbacks_identical"]
+    )
+    sys.exit(0 if identical else 1)
@@ -1,93 +1,879 @@
 from bottle import Bottle, request, response, run
-from datetime import datetime, timedelta
+from datetime import datetime
 from Event_Logger import Logger
 from NaivePlanner import NaivePlanner
-
-# from GeneticPlanner import GeneticPlanner
-import sys, threading, time, json, requests
+from GeneticPlanner import GeneticPlanner
+from GridPlanner import GridPlanner
+from ProblemConfig import compile_config
+from Occupancy import OccupancyTracker, ActiveEnds
+from PlanCache import PlanCache
+from Trace import TraceRecorder
+from Kpi import KpiAggregator
+import os, sys, threading, time, json, copy, requests
 import HealthcareProblem
 
 # server configs
 app = Bottle()
 
 # general configs
-events = {}
-waiting_requests = []
-lock = threading.Lock()
-next_id = 1
-known_ids = set()
-last_StartEvent = 0
-logger = Logger("log.csv")
-SIMULATION_END = None
 SIMULATION_START = datetime(2018, 1, 1)
+default_scenario = "default"  # scenario of the routes without scenario id
 
 # case specific configs
-events = HealthcareProblem.events
 start_event = "Admission"  # chronological order only secured for this event
-replanned_requests = []
+end_event = "Releasing"  # last event of a stay, only a replanned start event can follow
+min_replan_delay = 24 * 60  # replanned patients arrive at least one day later
+# replanned patients arrive during the working hours of this event
+plan_event = "Intake"
+# planners are built from the compiled config of their scenario
+planners = {
+    "naive": lambda problem: NaivePlanner(SIMULATION_START, problem),
+    "genetic": GeneticPlanner,
+    "grid": GridPlanner,
+}
 
+# retention: bookings that end before the horizon are archived (the log keeps all of them)
+retention_margin = 24 * 60  # kept a day longer, e.g. for late plan requests
+archive_interval = 24 * 60  # minimum simulation time between two archivals
 
-@app.post("/incoming_event")
-def book_event():
-    with lock:
-        global next_id
-        # id is a positive int (everything else gets treated as new and is assigned an id)
-        id = request.forms.get("ID")
-        try:
-            id = int(id) if id is not None and int(id) > 0 else None
-        except (ValueError, TypeError):
-            id = None
+# backpressure: new non-EM start events are shed (HTTP 429) while the queue is this long
+max_waiting_requests = 1000
+retry_after = 1  # seconds until a shed request should be sent again
+# a shed admission not sent again with its id within this time (seconds) is given up
+shed_timeout = 10 * retry_after
+# CPEE process models do not send shed admissions again yet, so /incoming_event never sheds
+# (only /incoming_events, e.g. the PatientSpawner in batch mode)
+shed_single_events = False
+
+
+# State and booking logic of one simulation. Several scenarios run isolated in one process,
+# each with its own config, logger, planner and lock.
+class Scenario:
+    def __init__(
+        self,
+        simulation_end,
+        log_file="log.csv",
+        config=None,
+        new_planner=None,
+        queue_limit=max_waiting_requests,
+        batch_commit=False,
+        trace_file=None,
+        shed_timeout=shed_timeout,
+    ):
+        self.events = copy.deepcopy(
+            config if config is not None else HealthcareProblem.events
+        )
+        self.problem = compile_config(self.events, SIMULATION_START)
+        self.occupancy = {event_type: OccupancyTracker() for event_type in self.events}
+        # end times of the active bookings by event id, kept in sync with active_bookings
+        self.active_ends = [ActiveEnds() for _ in self.problem.events]
+        for event_type, event_data in self.events.items():
+            for booking in event_data["active_bookings"]:
+                self.active_ends[self.problem.event_id(event_type)].add(
+                    booking["id"], booking["end_time"]
+                )
+        self.waiting_requests = []
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.known_ids = set()
+        self.last_StartEvent = 0
+        self.arrival_watermark = 0  # no new start event arrives before this time
+        self.replanned_requests = []
+        self.kpis = KpiAggregator()  # scores while the simulation runs
+        self.logger = Logger(log_file, self.kpis)
+        self.simulation_end = simulation_end
+        # new_planner builds the planner from the compiled config (see planners), so the
+        # planner plans against the same capacities as the scenario
+        if new_planner is None:
+            new_planner = planners["naive"]
+        self.planner = new_planner(self.problem)
+        self.plan_cache = PlanCache()
+        self.archived_bookings = {event_type: 0 for event_type in self.events}
+        self.archive_time = 0  # bookings ending before this time have been archived
+        self.queue_limit = queue_limit
+        self.max_queue_depth = 0
+        self.shed_count = 0
+        # id assigned to a shed admission -> its arrival time, until it is sent again with
+        # this id and accepted (it arrives later than the start events accepted meanwhile)
+        self.shed_arrivals = {}
+        self.shed_deadlines = {}  # id -> monotonic time the shed admission is given up
+        self.shed_timeout = shed_timeout  # None = wait for every shed admission
+        # batch commit: the dispatcher writes the log rows of all requests it processes at once
+        # and returns their callbacks instead of sending them one by one
+        self.batch_commit = batch_commit
+        self.pending_log_rows = None  # rows of the current batch (None = log)
+        self.pending_callbacks = None  # callbacks of the current batch (None = send)
+        # optional trace of the inbound calls and callbacks (see TraceReplay.py)
+        self.trace = None
+        if trace_file:
+            self.trace = TraceRecorder(
+                trace_file,
+                {
+                    "simulation_end": simulation_end,
+                    "log_file": log_file,
+                    "config": {
+                        event_type: {
+                            "capacity": event["capacity"],
+                            "dependencies": event["dependencies"],
+                        }
+                        for event_type, event in self.events.items()
+                    },
+                    "planner": type(self.planner).__name__,
+                    "queue_limit": queue_limit,
+                    "batch_commit": batch_commit,
+                },
+            )
+
+    # files the scenario writes to, another scenario must not use them
+    def get_files(self):
+        files = [self.logger.log_file]
+        if self.trace is not None:
+            files.append(self.trace.trace_file)
+        return files
+
+    def record(self, kind, args, result=None):
+        if self.trace is not None:
+            self.trace.write(kind, args, result)
+
+    # id is a positive int (everything else gets treated as new and is assigned an id)
+    def new_request(
+        self, id, event_type, arrival_time, duration, metadata, cpee_callback
+    ):
+        id = parse_id(id)
         if id is None:
-            id = next_id
-            next_id += 1
+            id = self.next_id
+            self.next_id += 1
 
-        event_type = request.forms.get("Event_Type")
-        arrival_time = int(float(request.forms.get("Arrival_Time")))
-        duration = int(float(request.forms.get("Duration")))
-        metadata = request.forms.get("Metadata")  # for problem specific data
-        cpee_callback = request.headers.get("Cpee-Callback")
+        return {
+            "id": id,
+            "event_type": event_type,
+            "arrival_time": arrival_time,
+            "duration": duration,
+            "metadata": metadata,
+            "cpee_callback": cpee_callback,
+        }
 
-        if arrival_time > SIMULATION_END:
-            response.status = 400  # Bad Request
+    # returns the response data, or None if the request was deferred (answered later via callback)
+    def submit_request(self, req):
+        (can_process, start_time) = self.can_process_request(req)
+        if can_process:
+            return self.process_request(req, False, start_time)
+        if req["event_type"] != start_event:
+            self.enqueue_waiting(req)
+        return None
+
+    def enqueue_waiting(self, req):
+        self.waiting_requests.append(req)
+        self.occupancy[req["event_type"]].add_waiting(req["arrival_time"])
+        self.max_queue_depth = max(self.max_queue_depth, len(self.waiting_requests))
+
+    # only new patients are turned away, EM patients and patients already in the
+    # hospital (later events, replanned start events) are always accepted
+    def should_shed(self, id, event_type, metadata):
+        if event_type != start_event or "EM" in (metadata or ""):
+            return False
+        if parse_id(id) in self.known_ids:
+            return False
+        if len(self.waiting_requests) < self.queue_limit:
+            return False
+        self.shed_count += 1
+        return True
+
+    # returns the id the shed admission has to be sent again with
+    def shed(self, id, arrival_time):
+        id = parse_id(id)
+        if id not in self.shed_arrivals:
+            id = self.next_id
+            self.next_id += 1
+            self.shed_arrivals[id] = arrival_time
+        # the client is still trying, wait for it again
+        if self.shed_timeout is not None:
+            self.shed_deadlines[id] = time.monotonic() + self.shed_timeout
+        return id
+
+    # gives up the shed admissions that were not sent again in time, so they no longer hold
+    # back the safe time (ids: the given up admissions, e.g. of a trace)
+    def expire_shed_arrivals(self, ids=None):
+        if ids is None:
+            now = time.monotonic()
+            ids = [
+                id for id, deadline in self.shed_deadlines.items() if deadline <= now
+            ]
+        if not ids:
+            return
+        for id in ids:
+            self.shed_arrivals.pop(id, None)
+            self.shed_deadlines.pop(id, None)
+        self.record("shed_expired", ids)
+        self.release_replanned_requests(self.get_safe_time())
+
+    # earliest arrival of a shed admission that has not been accepted yet
+    def get_shed_horizon(self):
+        return min(self.shed_arrivals.values(), default=float("inf"))
+
+    def get_queue_stats(self):
+        return {
+            "queue_depth": len(self.waiting_requests),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_limit": self.queue_limit,
+            "replanned_requests": len(self.replanned_requests),
+            "shed_count": self.shed_count,
+            "shed_pending": len(self.shed_arrivals),
+        }
+
+    # everything but a new start event may be deferred and is then answered via its callback
+    def may_defer(self, id, event_type):
+        return event_type != start_event or parse_id(id) in self.known_ids
+
+    def dequeue_waiting(self, req):
+        self.waiting_requests.remove(req)
+        self.occupancy[req["event_type"]].remove_waiting(req["arrival_time"])
+
+    # inbound event (see /incoming_event), returns (http status, response data or None if
+    # the request was deferred)
+    def book(self, id, event_type, arrival_time, duration, metadata, cpee_callback):
+        if shed_single_events and self.should_shed(id, event_type, metadata):
+            return 429, {
+                "error": "Too many waiting requests, retry later with this id",
+                "id": self.shed(id, arrival_time),
+            }
+        req = self.new_request(
+            id, event_type, arrival_time, duration, metadata, cpee_callback
+        )
+
+        if arrival_time > self.simulation_end:
+            return 400, {
+                "error": f"Arrival time {arrival_time} exceeds simulation end time of {self.simulation_end}"
+            }
+        return 200, self.submit_request(req)
+
+    # inbound batch of events (see /incoming_events), returns the result of every item
+    def book_batch(self, items):
+        results = [None] * len(items)
+        reqs, indices = [], []
+        for index, item in enumerate(items):
+            if self.should_shed(item["id"], item["event_type"], item["metadata"]):
+                results[index] = {
+                    "shed": True,
+                    "retry_after": retry_after,
+                    "id": self.shed(item["id"], item["arrival_time"]),
+                }
+                continue
+            req = self.new_request(**item)
+            if req["arrival_time"] > self.simulation_end:
+                results[index] = {
+                    "id": req["id"],
+                    "error": f"Arrival time {req['arrival_time']} exceeds simulation end time of {self.simulation_end}",
+                }
+                continue
+            reqs.append(req)
+            indices.append(index)
+        for index, response_data in zip(indices, self.submit_requests(reqs)):
+            results[index] = response_data
+        return results
+
+    # evaluates several requests in arrival order, results keep the order of reqs
+    def submit_requests(self, reqs):
+        results = [None] * len(reqs)
+        for index in sorted(range(len(reqs)), key=lambda i: reqs[i]["arrival_time"]):
+            response_data = self.submit_request(reqs[index])
+            if response_data is None:
+                response_data = {"id": reqs[index]["id"], "deferred": True}
+            results[index] = response_data
+        return results
+
+    # plans are cached per diagnosis and time bucket as offset to the arrival time, until
+    # the state the planner plans against changes
+    def plan_arrival(self, id, arrival_time, metadata):
+        key = self.plan_cache.get_key(
+            type(self.planner).__name__, metadata, arrival_time
+        )
+        # an offset of an arrival later in the bucket may end in a closed hour
+        offset = self.plan_cache.get(
+            key,
+            lambda offset: offset >= min_replan_delay
+            and self.problem.is_working_hour(plan_event, arrival_time + offset),
+        )
+        if offset is None:
+            replanned_time = self.compute_plan(id, arrival_time, metadata)
+            self.plan_cache.put(key, replanned_time - arrival_time)
+        else:
+            replanned_time = arrival_time + offset
+        # planners with their own schedule have committed the returned plan
+        if hasattr(self.planner, "scheduled_patients"):
+            self.plan_cache.invalidate()
+        return replanned_time
+
+    # planner times are in hours, simulator times in minutes
+    def compute_plan(self, id, arrival_time, metadata):
+        if isinstance(self.planner, NaivePlanner):
+            return self.planner.plan(arrival_time)
+        resources = [
+            {**res, "start": res["start"] / 60}
+            for res in self.get_simulation_state(arrival_time)
+        ]
+        replanned_time = self.planner.plan(
+            id, arrival_time / 60, {"diagnosis": metadata}, resources
+        )
+        return int(round(replanned_time * 60))
+
+    # plans several patients (id, arrival_time, metadata) of one tick at once, returns
+    # {id: replanned_time}; planners without plan_batch plan them one after another
+    def plan_arrivals(self, patients):
+        if not hasattr(self.planner, "plan_batch"):
             return {
-                "error": f"Arrival time {arrival_time} exceeds simulation end time of {SIMULATION_END}"
+                id: self.plan_arrival(id, arrival_time, metadata)
+                for id, arrival_time, metadata in patients
             }
+        # no patient is planned earlier than allowed for the latest of them
+        current_time = max(arrival_time for _, arrival_time, _ in patients)
+        resources = [
+            {**res, "start": res["start"] / 60}
+            for res in self.get_simulation_state(current_time)
+        ]
+        replanned_times = self.planner.plan_batch(
+            [(id, {"diagnosis": metadata}) for id, _, metadata in patients],
+            current_time / 60,
+            resources,
+        )
+        self.plan_cache.invalidate()
+        return {id: int(round(t * 60)) for id, t in replanned_times.items()}
+
+    def get_capacity(self, event_type, start_time):
+        return self.problem.get_capacity(event_type, start_time)
+
+    # no new start event can arrive before the safe time (a shed admission still arrives)
+    def get_safe_time(self):
+        return min(
+            max(self.last_StartEvent, self.arrival_watermark), self.get_shed_horizon()
+        )
+
+    # replanned start events are processed once no new start event can arrive before them
+    def release_replanned_requests(self, time):
+        time = min(time, self.get_shed_horizon())
+        self.replanned_requests.sort(key=lambda x: x["arrival_time"])
+        released = [r for r in self.replanned_requests if r["arrival_time"] < time]
+        self.replanned_requests = [
+            r for r in self.replanned_requests if r["arrival_time"] >= time
+        ]
+        for replanned_req in released:
+            self.process_request(replanned_req, True, replanned_req["arrival_time"])
+
+    # the driver of the arrivals (e.g. the PatientSpawner) knows the arrival schedule in advance
+    # and can declare that no new start event arrives before time (like lookahead in conservative PDES)
+    def advance_watermark(self, time):
+        if time <= self.arrival_watermark:
+            return
+        self.arrival_watermark = time
+        self.release_replanned_requests(time)
+
+    # Check whether any event can still influence the current event -> if not, the current event can be processed
+    # if event can be processed, return (True, Start_Time)
+    def can_process_request(self, req):
+        req_id = req["id"]
+        event_type = req["event_type"]
+        arrival_time = req["arrival_time"]
+        compiled_event = self.problem.get_event(event_type)
+        dependencies = compiled_event.dependencies
+
+        # ---------cause of planner---------#
+        if event_type == start_event and req_id in self.known_ids:
+            # nothing releases it later once no new start event can arrive before it
+            if arrival_time < self.get_safe_time():
+                return (True, arrival_time)
+            self.replanned_requests.append(req)
+            return (False, None)
+        if event_type == start_event and req_id not in self.known_ids:
+            self.release_replanned_requests(arrival_time)
+        # ---------cause of planner---------#
+
+        for waiting_req in self.waiting_requests:
+            if (
+                waiting_req["event_type"] == event_type
+                and waiting_req["arrival_time"] < arrival_time
+                and waiting_req["id"] != req_id
+            ):
+                return (False, None)
+
+        # no dependencies (in our case Admission, Releasing)
+        if not dependencies and req_id not in self.known_ids:
+            return (True, arrival_time)
 
-        req = {
+        # check whether totally new requests might still arrive (that could be prioticized higher)
+        if self.get_safe_time() < arrival_time:
+            return (False, None)
+
+        # Check whether any dependency ends earlier and might still need to be proptized
+        # (closest upstream stage first, from the end times of its active bookings)
+        for dep_id in compiled_event.dependency_ids:
+            if self.active_ends[dep_id].ends_before(arrival_time, req_id):
+                return (False, None)
+
+        # Calculate start time, check whether start time is still in the allowed time frame -> no events could still arrive before start time
+        event = self.events[event_type]
+        bookings = event["bookings"]
+        start_time = arrival_time
+        while True:
+            capacity = self.get_capacity(event_type, start_time)
+            if capacity == 0:
+                # capacities are per hour, skip to the next hour
+                start_time = (start_time // 60 + 1) * 60
+                continue
+            overlapping_bookings = [
+                b
+                for b in bookings
+                if not (
+                    b["end_time"] < start_time
+                    or b["start_time"] > start_time + req["duration"]
+                )
+            ]
+            if len(overlapping_bookings) < capacity:
+                break
+            start_time = min(b["end_time"] for b in overlapping_bookings) + 1
+        if self.get_safe_time() < start_time:
+            return (False, None)
+
+        ###-----------------------------------------Case specific (Priorizize EM Patients)-----------------------------------------###
+        for waiting_req in self.waiting_requests:
+            if (
+                "EM" in (waiting_req["metadata"] or "")
+                and waiting_req["event_type"] == event_type
+                and waiting_req["arrival_time"] < start_time
+                and req_id != waiting_req["id"]
+            ):
+                self.process_request(waiting_req, True, start_time)
+                self.dequeue_waiting(waiting_req)
+                return (False, None)
+        ###-----------------------------------------Case specific (Priorizize EM Patients)-----------------------------------------###
+
+        # event may be processed for start_time
+        return (True, start_time)
+
+    def process_request(self, req, async_response, start_time):
+        event_type = req["event_type"]
+        arrival_time = req["arrival_time"]
+        duration = req["duration"]
+        id = req["id"]
+        metadata = req["metadata"]
+        cpee_callback = req["cpee_callback"]
+
+        event = self.events[event_type]
+        bookings = event["bookings"]
+        active_bookings = event["active_bookings"]
+
+        end_time = start_time + duration
+
+        booking = {
             "id": id,
             "event_type": event_type,
+            "start_time": start_time,
+            "end_time": end_time,
             "arrival_time": arrival_time,
             "duration": duration,
             "metadata": metadata,
-            "cpee_callback": cpee_callback,
         }
 
-        (can_process, start_time) = can_process_request(req)
-        if can_process:
-            return process_request(req, False, start_time)
+        bookings.append(booking)
+        active_bookings.append(booking)
+        self.active_ends[self.problem.event_id(event_type)].add(id, end_time)
+        self.occupancy[event_type].add_booking(start_time, end_time)
+        # the NaivePlanner only gets the arrival time (see compute_plan)
+        if not isinstance(self.planner, NaivePlanner):
+            self.plan_cache.invalidate()
+
+        # delete old booking for id (only from active bookings)
+        for event_name, event_data in self.events.items():
+            active_ends = self.active_ends[self.problem.event_id(event_name)]
+            if event_name != event_type and id in active_ends:
+                other_bookings = event_data["active_bookings"]
+                event_data["active_bookings"] = [
+                    b for b in other_bookings if b["id"] != id
+                ]
+                active_ends.remove(id)
+
+        row = (id, event_type, arrival_time, start_time, end_time, metadata)
+        if self.pending_log_rows is not None:
+            self.pending_log_rows.append(row)
+        else:
+            self.logger.log_event(*row)
+        response_data = {
+            "id": id,
+            "arrival_time": arrival_time,
+            "start_time": start_time,
+            "end_time": end_time,
+        }
+
+        if event_type == start_event:
+            if (
+                id not in self.known_ids
+            ):  # replanned requests arent necessarily in the right order
+                # a shed admission sent again arrives after later start events
+                self.last_StartEvent = max(self.last_StartEvent, arrival_time)
+                self.known_ids.add(id)
+            if not "EM" in (metadata or ""):
+                response_data = self.handle_HCProblem_logic(
+                    req
+                )  # case specific: send home or not
+            # the accepted shed admission no longer holds back the safe time
+            self.shed_deadlines.pop(id, None)
+            if self.shed_arrivals.pop(id, None) is not None:
+                self.release_replanned_requests(self.get_safe_time())
+
+        if async_response:
+            # in-process drivers pass callables, only CPEE urls are recorded
+            url = cpee_callback if isinstance(cpee_callback, str) else None
+            self.record("callback", [url], response_data)
+        if async_response and self.pending_callbacks is not None:
+            self.pending_callbacks.append((cpee_callback, response_data))
+        elif async_response:
+            send_callback(cpee_callback, response_data)
         else:
-            if event_type != start_event:
-                waiting_requests.append(req)
-            response.headers["Cpee-Callback"] = "true"
+            return response_data
+
+    # returns the callbacks of the processed requests that still have to be sent (batch commit)
+    def dispatch_waiting_requests(self):
+        self.waiting_requests = sorted(
+            self.waiting_requests, key=lambda x: x["arrival_time"]
+        )
+        if self.batch_commit:
+            self.pending_log_rows, self.pending_callbacks = [], []
+        safe_time = self.get_safe_time()  # only changes with new start events
+        index = 0
+        while index < len(self.waiting_requests):
+            req = self.waiting_requests[index]
+            # in batch commit mode, skip the requests that have to wait for the safe time
+            # without evaluating them (can_process_request would reject them)
+            if self.batch_commit and self.waits_for_safe_time(req, safe_time):
+                index += 1
+                continue
+            (can_process, start_time) = self.can_process_request(req)
+            if can_process:
+                self.process_request(req, True, start_time)
+                self.dequeue_waiting(req)
+            else:
+                index += 1
+        callbacks = []
+        if self.batch_commit:
+            self.logger.log_events(self.pending_log_rows)
+            callbacks = self.pending_callbacks
+            self.pending_log_rows, self.pending_callbacks = None, None
+        self.archive_bookings()
+        return callbacks
+
+    def waits_for_safe_time(self, req, safe_time):
+        if req["arrival_time"] <= safe_time:
+            return False
+        dependencies = self.problem.get_event(req["event_type"]).dependencies
+        return bool(dependencies) or req["id"] in self.known_ids
+
+    # earliest time any pending or future request could still overlap: new start events arrive
+    # after the safe time, all other requests at the end of the active booking of their patient
+    def get_retention_horizon(self):
+        horizon = self.get_safe_time()
+        for req in self.waiting_requests + self.replanned_requests:
+            horizon = min(horizon, req["arrival_time"])
+        for event_type in self.events:
+            if event_type == end_event:
+                continue
+            active_ends = self.active_ends[self.problem.event_id(event_type)]
+            horizon = min(horizon, active_ends.get_earliest_end())
+        return horizon
+
+    # keeps the bookings bounded to the running stays, no matter how long the simulated horizon is
+    def archive_bookings(self):
+        # the horizon never exceeds the safe time, only compute it once an archival is due
+        if (
+            self.get_safe_time() - retention_margin
+            < self.archive_time + archive_interval
+        ):
+            return
+        cutoff = self.get_retention_horizon() - retention_margin
+        if cutoff < self.archive_time + archive_interval:
             return
+        for event_type, event_data in self.events.items():
+            bookings = [b for b in event_data["bookings"] if b["end_time"] >= cutoff]
+            self.archived_bookings[event_type] += len(event_data["bookings"]) - len(
+                bookings
+            )
+            event_data["bookings"] = bookings
+            active_ends = self.active_ends[self.problem.event_id(event_type)]
+            for booking in event_data["active_bookings"]:
+                if booking["end_time"] < cutoff:
+                    active_ends.remove(booking["id"], booking["end_time"])
+            event_data["active_bookings"] = [
+                b for b in event_data["active_bookings"] if b["end_time"] >= cutoff
+            ]
+        self.archive_time = cutoff
 
+    def handle_HCProblem_logic(self, req):
 
-@app.post("/plan_patient")
-def replan_patient():
-    planner = NaivePlanner(SIMULATION_START)
-    # g_planner = GeneticPlanner()
-    id = request.forms.get("ID")
-    arrival_time = int(float(request.forms.get("Arrival_Time")))
-    metadata = request.forms.get("Metadata")  # Für spezifische Problem-Daten
-    replanned_time = planner.plan(arrival_time)
-    # current_state = get_simulation_state(replanned_time)
-    # replanned_time = g_planner.plan(id, arrival_time, metadata, {"diagnosis": metadata}, current_state)
+        # active bookings and waiting requests from the running counters of the event
+        def check_traffic(event_type, arrival_time):
+            capacity = self.get_capacity(event_type, arrival_time)
+            tracker = self.occupancy[event_type]
+            active_bs = tracker.get_occupancy(
+                arrival_time, self.events[event_type]["bookings"]
+            )
+            waiting_rs = tracker.get_waiting(arrival_time)
+            total_requests = active_bs + waiting_rs
+            return total_requests, capacity
+
+        arrival_time = req["arrival_time"]
+        id = req["id"]
+
+        total_intake_requests, intake_capacity = check_traffic("Intake", arrival_time)
+        if total_intake_requests >= intake_capacity:
+            print(f"Sending patient {id} home due to intake capacity")
+            self.kpis.add_send_home_decision(id, True, "intake_capacity")
+            return {"send_home": True, "id": id}
+
+        event_types = ["Surgery", "Nursing_A", "Nursing_B"]
+        excess_requests = 0
 
+        for event_type in event_types:
+            total_requests, capacity = check_traffic(event_type, arrival_time)
+            if total_requests > capacity:
+                excess_requests += total_requests - capacity
+        if excess_requests > 2:
+            print(
+                f"Sending patient {id} home due to excess requests: {excess_requests}"
+            )
+            self.kpis.add_send_home_decision(id, True, "excess_requests")
+            return {"send_home": True, "id": id}
+        self.kpis.add_send_home_decision(id, False)
+        return {"send_home": False, "id": id}
+
+    def get_simulation_state(self, time):
+        state = []
+        for event_type, event_data in self.events.items():
+            for booking in event_data["bookings"]:
+                if booking["start_time"] < time and booking["end_time"] >= time:
+                    state.append(
+                        {
+                            "cid": booking["id"],
+                            "task": event_type,
+                            "start": booking["start_time"],
+                            "info": {"diagnosis": booking["metadata"]},
+                            "wait": False,
+                        }
+                    )
+            for booking in event_data["active_bookings"]:
+                if booking["start_time"] > time:
+                    state.append(
+                        {
+                            "cid": booking["id"],
+                            "task": event_type,
+                            "start": booking["arrival_time"],
+                            "info": {"diagnosis": booking["metadata"]},
+                            "wait": True,
+                        }
+                    )
+        # waiting requests have no start time yet
+        for req in self.waiting_requests:
+            state.append(
+                {
+                    "cid": req["id"],
+                    "task": req["event_type"],
+                    "start": req["arrival_time"],
+                    "info": {"diagnosis": req["metadata"]},
+                    "wait": True,
+                }
+            )
+        return state
+
+
+def parse_id(id):
+    try:
+        return int(id) if id is not None and int(id) > 0 else None
+    except (ValueError, TypeError):
+        return None
+
+
+# all hosted scenarios by id, the routes without scenario id use the default scenario
+scenarios = {}
+scenarios_lock = threading.Lock()  # only for adding and removing scenarios
+
+
+def get_scenario(scenario_id=default_scenario):
+    return scenarios.get(scenario_id)
+
+
+# (re)initialize a whole scenario, e.g. for several runs in one process
+def reset_simulation(
+    simulation_end,
+    log_file="log.csv",
+    config=None,
+    new_planner=None,
+    scenario_id=default_scenario,
+    batch_commit=False,
+    trace_file=None,
+):
+    scenario = Scenario(
+        simulation_end,
+        log_file,
+        config,
+        new_planner,
+        batch_commit=batch_commit,
+        trace_file=trace_file,
+    )
+    with scenarios_lock:
+        scenarios[scenario_id] = scenario
+    return scenario
+
+
+def unknown_scenario(scenario_id):
+    response.status = 404  # Not Found
+    return {"error": f"Unknown scenario {scenario_id}"}
+
+
+# form fields: Simulation_End, optional Planner (naive, genetic, grid), Log_File,
+# Config (JSON of the events, see HealthcareProblem.events), Queue_Limit, Batch_Commit and
+# Trace_File
+@app.post("/scenarios/<scenario_id>")
+def create_scenario(scenario_id):
+    log_file = request.forms.get("Log_File") or f"log_{scenario_id}.csv"
+    trace_file = request.forms.get("Trace_File")
+    # checked before the Scenario is built, its Logger and trace truncate their files
+    with scenarios_lock:
+        if scenario_id in scenarios:
+            response.status = 409  # Conflict
+            return {"error": f"Scenario {scenario_id} already exists"}
+        used_files = {
+            os.path.abspath(file)
+            for scenario in scenarios.values()
+            for file in scenario.get_files()
+        }
+        for file in [log_file, trace_file]:
+            if file and os.path.abspath(file) in used_files:
+                response.status = 409  # Conflict
+                return {"error": f"File {file} is used by another scenario"}
+        try:
+            simulation_end = int(float(request.forms.get("Simulation_End")))
+            planner_name = request.forms.get("Planner") or "naive"
+            config = request.forms.get("Config")
+            config = json.loads(config) if config else None
+            queue_limit = request.forms.get("Queue_Limit")
+            scenario = Scenario(
+                simulation_end,
+                log_file,
+                config,
+                planners[planner_name],
+                int(queue_limit) if queue_limit else max_waiting_requests,
+                request.forms.get("Batch_Commit") in ["1", "true"],
+                trace_file,
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            response.status = 400  # Bad Request
+            return {"error": f"Invalid scenario: {e}"}
+        scenarios[scenario_id] = scenario
+    return {"scenario": scenario_id, "simulation_end": simulation_end}
+
+
+@app.delete("/scenarios/<scenario_id>")
+def delete_scenario(scenario_id):
+    with scenarios_lock:
+        if scenarios.pop(scenario_id, None) is None:
+            return unknown_scenario(scenario_id)
+    return {"scenario": scenario_id, "deleted": True}
+
+
+@app.get("/scenarios")
+def list_scenarios():
+    return {"scenarios": list(scenarios)}
+
+
+@app.post("/incoming_event")
+@app.post("/scenarios/<scenario_id>/incoming_event")
+def book_event(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    with scenario.lock:
+        args = [
+            request.forms.get("ID"),
+            request.forms.get("Event_Type"),
+            int(float(request.forms.get("Arrival_Time"))),
+            int(float(request.forms.get("Duration"))),
+            request.forms.get("Metadata"),  # for problem specific data
+            request.headers.get("Cpee-Callback"),
+        ]
+        status, response_data = scenario.book(*args)
+        scenario.record("event", args, [status, response_data])
+
+    response.status = status
+    if status == 429:
+        response.headers["Retry-After"] = str(retry_after)
+    if response_data is None:
+        response.headers["Cpee-Callback"] = "true"
+        return
+    return response_data
+
+
+# body is a JSON array or JSON lines, one object per event (keys as for /incoming_event,
+# deferred events are answered via their own "Cpee_Callback")
+def parse_events(body):
+    body = body.decode("utf-8").strip()
+    if body.startswith("["):
+        return json.loads(body)
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+@app.post("/incoming_events")
+@app.post("/scenarios/<scenario_id>/incoming_events")
+def book_events(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    try:
+        items = [
+            {
+                "id": item.get("ID"),
+                "event_type": item["Event_Type"],
+                "arrival_time": int(float(item["Arrival_Time"])),
+                "duration": int(float(item["Duration"])),
+                "metadata": item.get("Metadata"),
+                "cpee_callback": item.get("Cpee_Callback"),
+            }
+            for item in parse_events(request.body.read())
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        response.status = 400  # Bad Request
+        return {"error": f"Invalid batch of events: {e}"}
+
+    with scenario.lock:
+        missing_callbacks = [
+            index
+            for index, item in enumerate(items)
+            if not item["cpee_callback"]
+            and scenario.may_defer(item["id"], item["event_type"])
+        ]
+        if missing_callbacks:
+            response.status = 400  # Bad Request
+            return {
+                "error": f"Events that may be deferred need a Cpee_Callback (items {missing_callbacks})"
+            }
+        results = scenario.book_batch(items)
+        scenario.record("events", items, results)
+
+    if any(result.get("shed") for result in results):
+        response.headers["Retry-After"] = str(retry_after)
+    return {"results": results}
+
+
+# base url of the routes of a scenario, the CPEE instance of a replanned patient books its
+# events there (a patient of another scenario would be unknown)
+def get_scenario_url(scenario_id):
+    return (
+        f"{request.urlparts.scheme}://{request.urlparts.netloc}/scenarios/{scenario_id}"
+    )
+
+
+def start_replanned_instance(id, metadata, replanned_time, scenario_url):
     base_url = "https://cpee.org/flow/start/url/"
     data = {
         "behavior": "fork_running",
         "url": "https://cpee.org/hub/server/Teaching.dir/Prak.dir/Challengers.dir/Julian_Simon.dir/Main.xml",
-        "init": f'{{"patient_id":"{id}","patient_type":"{metadata}","time_now":"{replanned_time}"}}',
+        "init": f'{{"patient_id":"{id}","patient_type":"{metadata}","time_now":"{replanned_time}","scenario_url":"{scenario_url}"}}',
     }
     try:
         response = requests.post(base_url, data=data)
@@ -97,278 +883,147 @@ def replan_patient():
         )
     except Exception as e:
         print(f"Error in replanning for patient {id}: {e}")
-    return {"replanned_time": replanned_time}
 
 
-def get_capacity(event, start_time):
-    current_datetime = SIMULATION_START + timedelta(minutes=start_time)
-    weekday = current_datetime.weekday()
-    hour = current_datetime.hour
-    for rule in event["capacity"]:
-        if weekday in rule["days"] and rule["start_hour"] <= hour < rule["end_hour"]:
-            return rule["capacity"]
-    return 0
-
-
-# Check whether any event can still influence the current event -> if not, the current event can be processed
-# if event can be processed, return (True, Start_Time)
-def can_process_request(req):
-    global last_StartEvent
-    global known_ids
-    global start_event
-    req_id = req["id"]
-    event_type = req["event_type"]
-    arrival_time = req["arrival_time"]
-    dependencies = events[event_type]["dependencies"]
-
-    # ---------cause of planner---------#
-    if event_type == start_event and req_id in known_ids:
-        replanned_requests.append(req)
-        return (False, None)
-    if event_type == start_event and req_id not in known_ids:
-        replanned_requests.sort(key=lambda x: x["arrival_time"])
-        for replanned_req in replanned_requests:
-            if replanned_req["arrival_time"] < arrival_time:
-                process_request(replanned_req, True, replanned_req["arrival_time"])
-                replanned_requests.remove(replanned_req)
-    # ---------cause of planner---------#
-
-    for waiting_req in waiting_requests:
-        if (
-            waiting_req["event_type"] == event_type
-            and waiting_req["arrival_time"] < arrival_time
-            and waiting_req["id"] != req_id
-        ):
-            return (False, None)
-
-    # no dependencies (in our case Admission, Releasing)
-    if not dependencies and req_id not in known_ids:
-        return (True, arrival_time)
+@app.post("/plan_patient")
+@app.post("/scenarios/<scenario_id>/plan_patient")
+def replan_patient(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    id = request.forms.get("ID")
+    arrival_time = int(float(request.forms.get("Arrival_Time")))
+    metadata = request.forms.get("Metadata")  # Für spezifische Problem-Daten
+    with scenario.lock:
+        replanned_time = scenario.plan_arrival(id, arrival_time, metadata)
+        scenario.record("plan", [id, arrival_time, metadata], replanned_time)
+        # cost of the plan (reported by the GeneticPlanner and GridPlanner)
+        planner_stats = getattr(scenario.planner, "last_plan_stats", None)
 
-    # check whether totally new requests might still arrive (that could be prioticized higher)
-    if last_StartEvent < arrival_time:
-        return (False, None)
+    start_replanned_instance(
+        id, metadata, replanned_time, get_scenario_url(scenario_id)
+    )
+    if planner_stats is not None:
+        return {"replanned_time": replanned_time, "planner_stats": planner_stats}
+    return {"replanned_time": replanned_time}
 
-    # Check whether any dependency ends earlier and might still need to be proptized
-    for dep_event in dependencies:
-        dep_bookings = events[dep_event]["active_bookings"]
-        for dep_booking in dep_bookings:
-            if dep_booking["id"] == req_id:
-                continue
-            if dep_booking["end_time"] < arrival_time:
-                return (False, None)
 
-    # Calculate start time, check whether start time is still in the allowed time frame -> no events could still arrive before start time
-    event = events[event_type]
-    bookings = event["bookings"]
-    start_time = arrival_time
-    while True:
-        capacity = get_capacity(event, start_time)
-        if capacity == 0:
-            start_time += 1
-            continue
-        overlapping_bookings = [
-            b
-            for b in bookings
-            if not (
-                b["end_time"] < start_time
-                or b["start_time"] > start_time + req["duration"]
-            )
+# body is a JSON array of {"ID", "Arrival_Time", "Metadata"} (all pending patients of a tick)
+@app.post("/plan_patients")
+@app.post("/scenarios/<scenario_id>/plan_patients")
+def replan_patients(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    try:
+        patients = [
+            (item["ID"], int(float(item["Arrival_Time"])), item.get("Metadata"))
+            for item in json.loads(request.body.read().decode("utf-8"))
         ]
-        if len(overlapping_bookings) < capacity:
-            break
-        start_time = min(b["end_time"] for b in overlapping_bookings) + 1
-    if last_StartEvent < start_time:
-        return (False, None)
-
-    ###-----------------------------------------Case specific (Priorizize EM Patients)-----------------------------------------###
-    for waiting_req in waiting_requests:
-        if (
-            "EM" in (waiting_req["metadata"] or "")
-            and waiting_req["event_type"] == event_type
-            and waiting_req["arrival_time"] < start_time
-            and req_id != waiting_req["id"]
-        ):
-            process_request(waiting_req, True, start_time)
-            waiting_requests.remove(waiting_req)
-            return (False, None)
-    ###-----------------------------------------Case specific (Priorizize EM Patients)-----------------------------------------###
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        response.status = 400  # Bad Request
+        return {"error": f"Invalid batch of patients: {e}"}
+    if not patients:
+        return {"replanned_times": {}}
 
-    # event may be processed for start_time
-    return (True, start_time)
+    with scenario.lock:
+        replanned_times = scenario.plan_arrivals(patients)
+        scenario.record("plans", patients, replanned_times)
+        planner_stats = getattr(scenario.planner, "last_plan_stats", None)
 
+    scenario_url = get_scenario_url(scenario_id)
+    for id, _, metadata in patients:
+        start_replanned_instance(id, metadata, replanned_times[id], scenario_url)
+    result = {"replanned_times": replanned_times}
+    if planner_stats is not None:
+        result["planner_stats"] = planner_stats
+    return result
 
-def process_request(req, async_response, start_time):
-    global last_StartEvent
-    global start_event
 
-    event_type = req["event_type"]
-    arrival_time = req["arrival_time"]
-    duration = req["duration"]
-    id = req["id"]
-    metadata = req["metadata"]
-    cpee_callback = req["cpee_callback"]
+@app.get("/plan_cache")
+@app.get("/scenarios/<scenario_id>/plan_cache")
+def get_plan_cache_stats(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    with scenario.lock:
+        return scenario.plan_cache.get_stats()
 
-    event = events[event_type]
-    bookings = event["bookings"]
-    active_bookings = event["active_bookings"]
 
-    end_time = start_time + duration
+@app.get("/queue_stats")
+@app.get("/scenarios/<scenario_id>/queue_stats")
+def get_queue_stats(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    with scenario.lock:
+        return scenario.get_queue_stats()
 
-    booking = {
-        "id": id,
-        "event_type": event_type,
-        "start_time": start_time,
-        "end_time": end_time,
-        "arrival_time": arrival_time,
-        "duration": duration,
-        "metadata": metadata,
-    }
 
-    bookings.append(booking)
-    active_bookings.append(booking)
-
-    # delete old booking for id (only from active bookings)
-    for event_name, event_data in events.items():
-        if event_name != event_type:
-            other_bookings = event_data["active_bookings"]
-            event_data["active_bookings"] = [b for b in other_bookings if b["id"] != id]
-
-    logger.log_event(id, event_type, arrival_time, start_time, end_time, metadata)
-    response_data = {
-        "id": id,
-        "arrival_time": arrival_time,
-        "start_time": start_time,
-        "end_time": end_time,
-    }
+# scores and waiting times so far, e.g. to monitor (and abort) long runs
+@app.get("/kpis")
+@app.get("/scenarios/<scenario_id>/kpis")
+def get_kpis(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    with scenario.lock:
+        return scenario.kpis.get_kpis()
 
-    if event_type == start_event:
-        if (
-            id not in known_ids
-        ):  # replanned requests arent necessarily in the right order
-            last_StartEvent = arrival_time
-            known_ids.add(id)
-        if not "EM" in (metadata or ""):
-            response_data = handle_HCProblem_logic(
-                req
-            )  # case specific: send home or not
-
-    if async_response:
-        headers = {"Content-Type": "application/json"}
-        requests.put(cpee_callback, data=json.dumps(response_data), headers=headers)
-    else:
-        return response_data
 
+@app.post("/watermark")
+@app.post("/scenarios/<scenario_id>/watermark")
+def set_watermark(scenario_id=default_scenario):
+    scenario = get_scenario(scenario_id)
+    if scenario is None:
+        return unknown_scenario(scenario_id)
+    time = float(request.forms.get("Time"))
+    with scenario.lock:
+        scenario.record("watermark", [time])
+        scenario.advance_watermark(time)
+        callbacks = scenario.dispatch_waiting_requests()
+        watermark = scenario.arrival_watermark
+    send_callbacks(callbacks)
+    return {"watermark": watermark}
 
-def process_waiting_requests():
-    global waiting_requests
-    while True:
-        with lock:
-            waiting_requests = sorted(waiting_requests, key=lambda x: x["arrival_time"])
-            index = 0
-            while index < len(waiting_requests):
-                req = waiting_requests[index]
-                (can_process, start_time) = can_process_request(req)
-                if can_process:
-                    process_request(req, True, start_time)
-                    waiting_requests.remove(req)
-                else:
-                    index += 1
-        time.sleep(0.5)
 
+# callbacks are CPEE urls, in-process drivers may pass a callable instead
+def send_callback(cpee_callback, response_data):
+    if callable(cpee_callback):
+        cpee_callback(response_data)
+        return
+    headers = {"Content-Type": "application/json"}
+    requests.put(cpee_callback, data=json.dumps(response_data), headers=headers)
 
-def handle_HCProblem_logic(req):
-
-    def check_traffic(event_type, arrival_time):
-        global waiting_requests
-        capacity = get_capacity(events[event_type], arrival_time)
-        active_bs = [
-            b
-            for b in events[event_type]["bookings"]
-            if b["start_time"] <= arrival_time < b["end_time"]
-        ]
-        waiting_rs = [
-            r
-            for r in waiting_requests
-            if r["event_type"] == event_type and r["arrival_time"] <= arrival_time
-        ]
-        total_requests = len(active_bs) + len(waiting_rs)
-        return total_requests, capacity
-
-    arrival_time = req["arrival_time"]
-    id = req["id"]
 
-    total_intake_requests, intake_capacity = check_traffic("Intake", arrival_time)
-    if total_intake_requests >= intake_capacity:
-        print(f"Sending patient {id} home due to intake capacity")
-        return {"send_home": True, "id": id}
+def send_callbacks(callbacks):
+    for cpee_callback, response_data in callbacks:
+        send_callback(cpee_callback, response_data)
 
-    event_types = ["Surgery", "Nursing_A", "Nursing_B"]
-    excess_requests = 0
 
-    for event_type in event_types:
-        total_requests, capacity = check_traffic(event_type, arrival_time)
-        if total_requests > capacity:
-            excess_requests += total_requests - capacity
-    if excess_requests > 2:
-        print(f"Sending patient {id} home due to excess requests: {excess_requests}")
-        return {"send_home": True, "id": id}
-    return {"send_home": False, "id": id}
+# every scenario is dispatched under its own lock, callbacks of a batch are sent after it
+def process_waiting_requests():
+    while True:
+        for scenario in list(scenarios.values()):
+            with scenario.lock:
+                # shed admissions are given up in wall clock time, a step of its own in the trace
+                scenario.expire_shed_arrivals()
+                if scenario.waiting_requests:
+                    scenario.record("dispatch", [])
+                callbacks = scenario.dispatch_waiting_requests()
+            send_callbacks(callbacks)
+        time.sleep(0.5)
 
 
 if __name__ == "__main__":
-    threading.Thread(target=process_waiting_requests, daemon=True).start()
     if len(sys.argv) < 2:
         print("Bitte geben Sie die Simulationsdauer in Minuten an.")
         sys.exit(1)
-    SIMULATION_END = int(sys.argv[1])
+    options = dict(arg.split("=", 1) for arg in sys.argv[2:] if "=" in arg)
+    reset_simulation(
+        int(sys.argv[1]),
+        batch_commit="batch_commit" in sys.argv[2:],
+        trace_file=options.get("trace"),
+    )
+    threading.Thread(target=process_waiting_requests, daemon=True).start()
     run(app, host="::1", port=57874)
-
-
-def get_simulation_state(time):
-    state = []
-    for event_type, event_data in events.items():
-        for booking in event_data["bookings"]:
-            if booking["start_time"] < time and booking["end_time"] >= time:
-                state.append(
-                    {
-                        "cid": booking["id"],
-                        "task": event_type,
-                        "start": booking["start_time"],
-                        "info": {"diagnosis": booking["metadata"]},
-                        "wait": False,
-                    }
-                )
-        for booking in event_data["active_bookings"]:
-            if booking["start_time"] > time:
-                state.append(
-                    {
-                        "cid": booking["id"],
-                        "task": event_type,
-                        "start": booking["arrival_time"],
-                        "info": {"diagnosis": booking["metadata"]},
-                        "wait": True,
-                    }
-                )
-    for req in waiting_requests:
-        if req["start_time"] < time and booking["end_time"] >= time:
-            state.append(
-                {
-                    "cid": req["id"],
-                    "task": req["event_type"],
-                    "start": req["arrival_time"],
-                    "info": {"diagnosis": req["metadata"]},
-                    "wait": False,
-                }
-            )
-        elif booking["start_time"] > time:
-            state.append(
-                {
-                    "cid": req["id"],
-                    "task": req["event_type"],
-                    "start": req["arrival_time"],
-                    "info": {"diagnosis": req["metadata"]},
-                    "wait": True,
-                }
-            )
-    return json.dumps(state, indent=4)